@@ -40,15 +40,15 @@ class TimeSeriesKNN:
 
         Parameters
         ----------
-        X_train : numpy.ndarrray (2d array of shape (ts_number, ts_length))
-            The train set.
+        X_train : numpy.ndarrray or pandas.DataFrame (2d array of shape (ts_number, ts_length))
+            The train set (a sliding window view is used as is, without copying).
         
         Y_train : numpy.ndarrray
             Labels of the train set.
         """
        
-        self.X_train = X_train.to_numpy()
-        self.Y_train = Y_train.to_numpy()
+        self.X_train = np.asarray(X_train)
+        self.Y_train = np.asarray(Y_train)
 
 
     def _distance(self, x_train, x_test):
@@ -1,9 +1,13 @@
 import numpy as np
-from sklearn.cluster import AgglomerativeClustering
-from scipy.cluster.hierarchy import dendrogram
+from scipy.cluster.hierarchy import dendrogram, linkage, fcluster, to_tree
+from scipy.spatial.distance import squareform
 
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from modules.parallel import ParallelDTWDistanceMatrix, ParallelCenterAssignment
 
 
 class TimeSeriesHierarchicalClustering:
@@ -13,15 +17,18 @@ class TimeSeriesHierarchicalClustering:
     Parameters
     ----------
 
-    n_clusters : int, default = 3
+    n_clusters : int, default = 2
         The number of clusters.
     
     method : str, default = 'complete'
         The linkage criterion.
         Options: {single, complete, average, weighted}.
 
-    model : sklearn object
-        An sklearn agglomerative clustering.
+    model : numpy.ndarray
+        The scipy linkage matrix of the fitted model.
+
+    labels_ : numpy.ndarray
+        Cluster labels (from 0 to n_clusters-1) of dataset's instances.
     """
 
     def __init__(self, n_clusters=2, method='complete'):
@@ -30,6 +37,8 @@ class TimeSeriesHierarchicalClustering:
         self.method = method
         self.model = None
         self.linkage_matrix = None
+        self.labels_ = None
+        self.distance_matrix = None
 
     def _create_linkage_matrix(self):
         """
@@ -41,32 +50,51 @@ class TimeSeriesHierarchicalClustering:
             The linkage matrix.
         """
 
-        counts = np.zeros(self.model.children_.shape[0])
-        n_samples = len(self.model.labels_)
-
-        for i, merge in enumerate(self.model.children_):
-            current_count = 0
-            for child_idx in merge:
-                if child_idx < n_samples:
-                    current_count += 1  # leaf node
-                else:
-                    current_count += counts[child_idx - n_samples]
-            counts[i] = current_count
-
-        linkage_matrix = np.column_stack([self.model.children_, self.model.distances_, counts]).astype(float)
+        # the merged clusters, merge distances and cluster sizes are computed by scipy linkage
+        linkage_matrix = self.model.astype(float)
         self.linkage_matrix = linkage_matrix
 
         return linkage_matrix
 
 
+    def _color_threshold(self):
+        """
+        Height of the cut of the dendrogram into n_clusters clusters.
+
+        The cut is the midpoint between the n_clusters-th highest merge and the next
+        higher one, so the colored subtrees are the clusters of
+        fcluster(..., criterion='maxclust') even if the merge heights tie.
+
+        Returns
+        -------
+        color_threshold : float
+            The color threshold of the dendrogram.
+        """
+
+        Z = self.linkage_matrix
+        k = self.n_clusters
+        # every time series is a cluster (or there is only one cluster): no colored links
+        if (k <= 1) or (k > Z.shape[0]):
+            return 0
+
+        lower = Z[-k, 2]
+        higher = Z[Z[:, 2] > lower, 2]
+        if len(higher) == 0:
+            return lower + 1
+
+        return (lower + higher.min()) / 2
+
+
     def fit(self, distance_matrix):
         """
         Fit the agglomerative clustering model based on distance matrix.
 
         Parameters
         ----------
-        distance_matrix : numpy.ndarray (2d array of shape (ts_number, ts_number))
-            The distance matrix between instances of dataset.
+        distance_matrix : numpy.ndarray (1d array of shape (ts_number*(ts_number-1)/2,)
+                          or 2d array of shape (ts_number, ts_number))
+            The distance matrix between instances of dataset in condensed
+            (see scipy.spatial.distance.squareform) or square form.
         
         Returns
         -------
@@ -74,8 +102,16 @@ class TimeSeriesHierarchicalClustering:
             The fitted model.
         """
 
-         # INSERT YOUR CODE
-        self.model = AgglomerativeClustering(compute_distances=True).fit(distance_matrix)
+        distance_matrix = np.asarray(distance_matrix, dtype=np.float64)
+        if distance_matrix.ndim == 2:
+            distance_matrix = squareform(distance_matrix, checks=False)
+
+        # the condensed distances are kept (without copying) to find the medoids of clusters
+        self.distance_matrix = distance_matrix
+        self.model = linkage(distance_matrix, method=self.method)
+        self._create_linkage_matrix()
+
+        self.labels_ = fcluster(self.model, t=self.n_clusters, criterion='maxclust') - 1
           
         return self
 
@@ -126,9 +162,160 @@ class TimeSeriesHierarchicalClustering:
             plt.text(ts_len+margin, 0, f'class = {label}')
 
 
+    def _node_members(self, leaves):
+        """
+        Find the instances of dataset in the (truncated) dendrogram leaves.
+
+        Parameters
+        ----------
+        leaves : list
+            Leave node names from scipy dendrogram (merged clusters have ids >= ts_number).
+
+        Returns
+        -------
+        members : list of numpy.ndarray
+            Indices of dataset's instances in each leaf.
+        """
+
+        _, nodes = to_tree(self.linkage_matrix, rd=True)
+
+        return [np.array(nodes[leaf].pre_order()) for leaf in leaves]
+
+
+    def _representative(self, members, ts_set, representative, max_members=200):
+        """
+        Choose the trace representing the cluster.
+
+        Parameters
+        ----------
+        members : numpy.ndarray
+            Indices of the cluster instances.
+
+        ts_set : numpy.ndarray
+            Time series set.
+
+        representative : str
+            'medoid' (the instance with the least total distance to the others)
+            or 'mean' (the pointwise mean of the instances).
+
+        max_members : int, default = 200
+            Maximum number of instances used to find the medoid
+            (larger clusters are subsampled evenly).
+
+        Returns
+        -------
+        trace : numpy.ndarray
+            The representative time series.
+        """
+
+        if representative == 'mean':
+            return np.mean(ts_set[members], axis=0)
+
+        candidates = members[np.linspace(0, len(members) - 1, min(len(members), max_members)).astype(np.int64)]
+        if len(candidates) == 1:
+            return ts_set[candidates[0]]
+
+        # distances between the candidates taken from the condensed distance matrix
+        N = len(self.linkage_matrix) + 1
+        i, j = np.meshgrid(candidates, candidates, indexing='ij')
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        off_diagonal = i != j
+        dist = np.zeros(i.shape)
+        dist[off_diagonal] = self.distance_matrix[N*i[off_diagonal] - i[off_diagonal]*(i[off_diagonal]+1)//2 + (j[off_diagonal] - i[off_diagonal] - 1)]
+
+        return ts_set[candidates[np.argmin(dist.sum(axis=1))]]
+
+
+    def plot_truncated_dendrogram(self, df, labels=None, p=30, representative='medoid', max_points=256,
+                                  title='Dendrogram', file_name=None, dpi=100):
+        """
+        Draw the dendrogram of the top p merges only, with one representative
+        time series graph for each truncated cluster.
+
+        Unlike plot_dendrogram, the number of subplots does not depend on the
+        size of dataset, so it is suited for large datasets.
+
+        Parameters
+        ----------
+        df : dataframe or numpy.ndarray
+            Time series set with each row being the time window of readings.
+
+        labels : numpy.ndarray, default = None
+            Labels of dataset's instances. If None, the cluster labels are used.
+            The trace is colored by the most frequent label of the cluster.
+
+        p : int, default = 30
+            Number of the dendrogram leaves (clusters formed by the last p-1 merges).
+
+        representative : str, default = 'medoid'
+            Representative of a cluster: 'medoid' or 'mean'.
+
+        max_points : int, default = 256
+            Maximum number of plotted points of a trace (longer traces are downsampled).
+
+        title : str, default = 'Dendrogram'
+            Title of dendrogram.
+
+        file_name : str, default = None
+            If given, the figure is rendered without display (Agg backend)
+            into the PNG file and closed.
+
+        dpi : int, default = 100
+            Resolution of the PNG file.
+
+        Returns
+        -------
+        fig : matplotlib.figure.Figure
+            The figure.
+        """
+
+        ts_set = np.asarray(df)
+        if labels is None:
+            labels = self.labels_
+        labels = np.asarray(labels).astype(np.int64)
+
+        p = min(p, len(self.linkage_matrix) + 1)
+        figsize = (12, max(4, 0.4*p))
+        if file_name is None:
+            fig = plt.figure(figsize=figsize)
+        else:
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+
+        gs = gridspec.GridSpec(p, 2, figure=fig, width_ratios=[3, 1], wspace=0.05)
+        ax = fig.add_subplot(gs[:, 0])
+        ax.set_xlabel("Distance")
+        ax.set_ylabel("Cluster")
+        ax.set_title(title, fontsize=16, weight='bold')
+
+        ddata = dendrogram(self.linkage_matrix, truncate_mode='lastp', p=p, orientation="left",
+                           color_threshold=self._color_threshold(), show_leaf_counts=True, ax=ax)
+
+        colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+        step = max(1, int(np.ceil(ts_set.shape[1] / max_points)))
+
+        # flip leaves, as gridspec iterates from top down
+        leaves = ddata["leaves"][::-1]
+        for cnt, members in enumerate(self._node_members(leaves)):
+            trace_ax = fig.add_subplot(gs[cnt, 1])
+            trace_ax.axis("off")
+
+            trace = self._representative(members, ts_set, representative)[::step]
+            label = int(np.bincount(labels[members] - labels.min()).argmax() + labels.min())
+
+            trace_ax.plot(trace, color=colors[label % len(colors)])
+            trace_ax.text(len(trace), 0, f'class = {label}, n = {len(members)}', fontsize=8)
+
+        if file_name is not None:
+            fig.savefig(file_name, dpi=dpi, bbox_inches='tight')
+
+        return fig
+
+
     def plot_dendrogram(self, df, labels, ts_hspace=12, title='Dendrogram'):
         """ 
         Draw agglomerative clustering dendrogram with timeseries graphs for all clusters.
+        For large datasets use plot_truncated_dendrogram.
 
         Parameters
         ----------
@@ -159,7 +346,276 @@ class TimeSeriesHierarchicalClustering:
         plt.ylabel("Cluster")
         plt.title(title, fontsize=16, weight='bold')
 
-        ddata = dendrogram(self.linkage_matrix, orientation="left", color_threshold=sorted(self.model.distances_)[-2], show_leaf_counts=True)
+        # the links below the cut into n_clusters clusters are colored by cluster
+        ddata = dendrogram(self.linkage_matrix, orientation="left", color_threshold=self._color_threshold(),
+                           show_leaf_counts=True)
 
         self._draw_timeseries_allclust(df, labels, ddata["leaves"], gs, ts_hspace)        
         
+
+
+def _PAM(distance_matrix, n_clusters, max_iter=100):
+    """
+    Partitioning Around Medoids (BUILD and SWAP phases) on the square distance matrix.
+
+    Parameters
+    ----------
+    distance_matrix : numpy.ndarray (2d array of shape (ts_number, ts_number))
+        The distance matrix.
+
+    n_clusters : int
+        The number of clusters.
+
+    max_iter : int, default = 100
+        Maximum number of swaps.
+
+    Returns
+    -------
+    medoids : numpy.ndarray
+        Indices of the medoids.
+    """
+
+    D = distance_matrix
+
+    # BUILD: greedily add the medoids which decrease the total distance most
+    medoids = [int(np.argmin(D.sum(axis=1)))]
+    for _ in range(1, n_clusters):
+        nearest = D[:, medoids].min(axis=1)
+        gain = np.maximum(nearest[np.newaxis, :] - D, 0).sum(axis=1)
+        gain[medoids] = -1
+        medoids.append(int(np.argmax(gain)))
+
+    # SWAP: replace a medoid with a non-medoid while the total distance decreases
+    for _ in range(max_iter):
+        best_cost = D[:, medoids].min(axis=1).sum()
+        best_swap = None
+        for pos in range(n_clusters):
+            others = medoids[:pos] + medoids[pos+1:]
+            nearest = D[:, others].min(axis=1) if others else np.full(D.shape[0], np.inf)
+            costs = np.minimum(nearest[np.newaxis, :], D).sum(axis=1)
+            candidate = int(np.argmin(costs))
+            if costs[candidate] < best_cost*(1 - 1e-12):
+                best_cost = costs[candidate]
+                best_swap = (pos, candidate)
+        if best_swap is None:
+            break
+        medoids[best_swap[0]] = best_swap[1]
+
+    return np.array(medoids)
+
+
+class TimeSeriesKMedoids:
+    """
+    K-medoids clustering of time series with DTW distance by CLARA
+    (Clustering LARge Applications).
+
+    PAM is run on the distance matrices of several random samples, and the whole
+    dataset is assigned to the medoids of each sample with lower-bounded DTW.
+    The medoids with the least total distance are kept, so only the distance
+    matrix of a sample is stored and the memory is linear in the number of time series.
+
+    Parameters
+    ----------
+    n_clusters : int, default = 2
+        The number of clusters.
+
+    r : float, default = 0.05
+        Warping window size.
+
+    n_samples : int, default = 5
+        Number of the samples.
+
+    sample_size : int, default = None
+        Number of time series in a sample. If None, 40 + 2*n_clusters is used.
+
+    max_iter : int, default = 100
+        Maximum number of PAM swaps on a sample.
+
+    n_jobs : int, default = None
+        Number of worker processes. If None, the number of CPUs is used.
+
+    seed : int or numpy.random.Generator, default = None
+        Seed of the random sampling.
+    """
+
+    def __init__(self, n_clusters=2, r=0.05, n_samples=5, sample_size=None, max_iter=100, n_jobs=None, seed=None):
+
+        self.n_clusters = n_clusters
+        self.r = r
+        self.n_samples = n_samples
+        self.sample_size = sample_size
+        self.max_iter = max_iter
+        self.n_jobs = n_jobs
+        self.seed = seed
+
+        self.medoid_indices_ = None
+        self.cluster_centers_ = None
+        self.labels_ = None
+        self.inertia_ = None
+        self.dtw_num = 0
+        self.pruned_num = 0
+
+
+    def fit(self, X):
+        """
+        Cluster the time series set.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (2d array of shape (ts_number, ts_length))
+            Time series set.
+
+        Returns
+        -------
+        self: object
+            The fitted model.
+        """
+
+        X = np.asarray(X, dtype=np.float64)
+        N = X.shape[0]
+        rng = np.random.default_rng(self.seed)
+
+        sample_size = self.sample_size if self.sample_size is not None else 40 + 2*self.n_clusters
+        sample_size = min(max(sample_size, self.n_clusters), N)
+        self.medoid_indices_ = None
+        self.inertia_ = None
+
+        distance_matrix_builder = ParallelDTWDistanceMatrix(r=self.r, n_jobs=self.n_jobs)
+
+        with ParallelCenterAssignment(X, r=self.r, n_jobs=self.n_jobs) as assignment:
+            for _ in range(self.n_samples):
+                # the best medoids so far are added to every next sample
+                sample = rng.choice(N, size=sample_size, replace=False)
+                if self.medoid_indices_ is not None:
+                    sample = np.concatenate((self.medoid_indices_, np.setdiff1d(sample, self.medoid_indices_)))[:sample_size]
+
+                distance_matrix = squareform(distance_matrix_builder.compute(X[sample]))
+                medoids = sample[_PAM(distance_matrix, self.n_clusters, self.max_iter)]
+
+                labels, distances = assignment.assign(X[medoids])
+                inertia = distances.sum()
+                if self.inertia_ is None or inertia < self.inertia_:
+                    self.medoid_indices_ = medoids
+                    self.labels_ = labels
+                    self.inertia_ = inertia
+
+            self.dtw_num = assignment.dtw_num
+            self.pruned_num = assignment.pruned_num
+
+        self.cluster_centers_ = X[self.medoid_indices_]
+
+        return self
+
+
+class TimeSeriesKMeans:
+    """
+    K-means clustering of time series with DTW distance and
+    DTW Barycenter Averaging (DBA) of the centroids.
+
+    The time series are assigned to the nearest centroids with lower-bounded DTW,
+    and every iteration refines the centroids by DBA in parallel. The initial
+    centroids are chosen by k-means++ seeding. Only the time series set, labels,
+    distances and centroids are stored, so the memory is linear in the number of time series.
+
+    Parameters
+    ----------
+    n_clusters : int, default = 2
+        The number of clusters.
+
+    r : float, default = 0.05
+        Warping window size.
+
+    max_iter : int, default = 10
+        Maximum number of iterations.
+
+    n_init : int, default = 3
+        Number of runs with different initial centroids (the run with
+        the least total distance is kept).
+
+    n_jobs : int, default = None
+        Number of worker processes. If None, the number of CPUs is used.
+
+    seed : int or numpy.random.Generator, default = None
+        Seed of the random initialization.
+    """
+
+    def __init__(self, n_clusters=2, r=0.05, max_iter=10, n_init=3, n_jobs=None, seed=None):
+
+        self.n_clusters = n_clusters
+        self.r = r
+        self.max_iter = max_iter
+        self.n_init = n_init
+        self.n_jobs = n_jobs
+        self.seed = seed
+
+        self.cluster_centers_ = None
+        self.labels_ = None
+        self.inertia_ = None
+        self.n_iter_ = 0
+        self.dtw_num = 0
+        self.pruned_num = 0
+
+
+    def _init_centers(self, X, assignment, rng):
+        """
+        Choose the initial centroids by k-means++ seeding: every next centroid is
+        a time series drawn with the probability proportional to its distance
+        to the nearest chosen centroid.
+        """
+
+        centers_idx = [int(rng.integers(X.shape[0]))]
+        for _ in range(1, self.n_clusters):
+            _, distances = assignment.assign(X[centers_idx])
+            total = distances.sum()
+            if total > 0:
+                centers_idx.append(int(rng.choice(X.shape[0], p=distances/total)))
+            else:
+                centers_idx.append(int(rng.integers(X.shape[0])))
+
+        return X[centers_idx].copy()
+
+
+    def fit(self, X):
+        """
+        Cluster the time series set.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (2d array of shape (ts_number, ts_length))
+            Time series set.
+
+        Returns
+        -------
+        self: object
+            The fitted model.
+        """
+
+        X = np.asarray(X, dtype=np.float64)
+        rng = np.random.default_rng(self.seed)
+        self.inertia_ = None
+
+        with ParallelCenterAssignment(X, r=self.r, n_jobs=self.n_jobs) as assignment:
+            for _ in range(self.n_init):
+                centers = self._init_centers(X, assignment, rng)
+                labels, distances = assignment.assign(centers)
+
+                n_iter = 0
+                for n_iter in range(1, self.max_iter + 1):
+                    centers = assignment.DBA_update(centers)
+                    new_labels, distances = assignment.assign(centers)
+                    converged = np.array_equal(new_labels, labels)
+                    labels = new_labels
+                    if converged:
+                        break
+
+                # keep the run with the least total distance
+                if self.inertia_ is None or distances.sum() < self.inertia_:
+                    self.cluster_centers_ = centers
+                    self.labels_ = labels
+                    self.inertia_ = distances.sum()
+                    self.n_iter_ = n_iter
+
+            self.dtw_num = assignment.dtw_num
+            self.pruned_num = assignment.pruned_num
+
+        return self
@@ -0,0 +1,615 @@
+import numpy as np
+import os
+import time
+from functools import partial
+from multiprocessing import Pool
+from multiprocessing import shared_memory
+from numba import njit
+
+from modules.metrics import DTW_distance, Kim_features, LB_Kim_by_features, LB_Keogh
+from modules.metrics import _DTW_window, _DTW_band, _DTW_band_path
+from modules.utils import envelope
+
+
+# arrays attached by the pool worker initializer (and their shared memory blocks)
+_worker_arrays = {}
+_worker_blocks = []
+
+
+def create_shared_array(shape, dtype=np.float64, data=None):
+    """
+    Allocate an array in shared memory.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array.
+
+    dtype : numpy.dtype, default = numpy.float64
+        Type of the array elements.
+
+    data : numpy.ndarray, default = None
+        Values to copy into the array.
+
+    Returns
+    -------
+    shm : multiprocessing.shared_memory.SharedMemory
+        The shared memory block (the caller has to release it with release_shared_arrays).
+
+    a : numpy.ndarray
+        The array backed by the shared memory block.
+    """
+
+    nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    a = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    if data is not None:
+        a[...] = data
+
+    return shm, a
+
+
+def share_arrays(arrays):
+    """
+    Copy the arrays into shared memory.
+
+    Parameters
+    ----------
+    arrays : dict
+        Array name -> numpy.ndarray.
+
+    Returns
+    -------
+    blocks : list
+        The shared memory blocks (to be released with release_shared_arrays).
+
+    specs : dict
+        Array name -> (shared memory name, shape, dtype), to be passed to attach_shared_arrays.
+    """
+
+    blocks = []
+    specs = {}
+    for key, a in arrays.items():
+        a = np.asarray(a)
+        shm, _ = create_shared_array(a.shape, a.dtype, a)
+        blocks.append(shm)
+        specs[key] = (shm.name, a.shape, a.dtype.str)
+
+    return blocks, specs
+
+
+def attach_shared_arrays(specs):
+    """
+    Attach the arrays placed in shared memory by another process.
+
+    Parameters
+    ----------
+    specs : dict
+        Array name -> (shared memory name, shape, dtype).
+
+    Returns
+    -------
+    arrays : dict
+        Array name -> numpy.ndarray backed by the shared memory.
+
+    blocks : list
+        The attached shared memory blocks (they must be kept alive while the arrays are used).
+    """
+
+    arrays = {}
+    blocks = []
+    for key, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    return arrays, blocks
+
+
+def release_shared_arrays(blocks):
+    """
+    Close and remove the shared memory blocks created by share_arrays.
+
+    Parameters
+    ----------
+    blocks : list
+        The shared memory blocks.
+    """
+
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def _init_worker(specs):
+    """
+    Pool worker initializer: attach the shared arrays.
+
+    Parameters
+    ----------
+    specs : dict
+        Array name -> (shared memory name, shape, dtype).
+    """
+
+    arrays, blocks = attach_shared_arrays(specs)
+    _worker_arrays.update(arrays)
+    _worker_blocks.extend(blocks)
+
+
+def _condensed_index(N, i, j):
+    """
+    Index of the pair (i, j), i < j, in the condensed distance matrix.
+    """
+
+    return N*i - i*(i+1)//2 + (j - i - 1)
+
+
+def _DTW_tile(tile, data, condensed, r):
+    """
+    Compute DTW distances of the pairs (i, j), i < j, covered by the tile.
+
+    Parameters
+    ----------
+    tile : tuple of int
+        (row start, row stop, column start, column stop).
+
+    data : numpy.ndarray (2d array of shape (ts_number, ts_length))
+        Time series set.
+
+    condensed : numpy.ndarray
+        Condensed distance matrix to write the distances into.
+
+    r : float
+        Warping window size.
+
+    Returns
+    -------
+    pairs_num : int
+        Number of computed pairs.
+    """
+
+    i_start, i_stop, j_start, j_stop = tile
+    N = data.shape[0]
+    pairs_num = 0
+
+    for i in range(i_start, i_stop):
+        for j in range(max(j_start, i+1), j_stop):
+            condensed[_condensed_index(N, i, j)] = DTW_distance(data[i], data[j], r)
+            pairs_num += 1
+
+    return pairs_num
+
+
+def _DTW_tile_worker(tile, r):
+    """
+    Pool task: compute a tile on the shared time series set.
+    """
+
+    return _DTW_tile(tile, _worker_arrays['data'], _worker_arrays['condensed'], r)
+
+
+class ParallelDTWDistanceMatrix:
+    """
+    Parallel builder of the DTW distance matrix.
+
+    The upper triangle of the distance matrix is split into square tiles which are
+    processed by a pool of worker processes. The time series set and the output
+    condensed distance matrix are placed in shared memory, so only tile bounds are
+    sent to workers.
+
+    Parameters
+    ----------
+    r : float, default = None
+        Warping window size.
+
+    n_jobs : int, default = None
+        Number of worker processes. If None, the number of CPUs is used.
+
+    tile_size : int, default = 64
+        Number of time series along a side of a tile.
+
+    callback : callable, default = None
+        Function called with the builder after every finished tile
+        (e.g. to report the progress).
+    """
+
+    def __init__(self, r=None, n_jobs=None, tile_size=64, callback=None):
+
+        self.r = r
+        self.n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+        self.tile_size = tile_size
+        self.callback = callback
+
+        self.pairs_total = 0
+        self.pairs_done = 0
+        self.elapsed_time = 0.0
+        self._start_time = None
+
+
+    @property
+    def progress(self):
+        """
+        Fraction of the computed pairs.
+        """
+
+        if self.pairs_total == 0:
+            return 0.0
+
+        return self.pairs_done / self.pairs_total
+
+
+    @property
+    def pairs_per_second(self):
+        """
+        Throughput of the computation.
+        """
+
+        if self.elapsed_time == 0:
+            return 0.0
+
+        return self.pairs_done / self.elapsed_time
+
+
+    def _tiles(self, N):
+        """
+        Split the upper triangle of the N x N matrix into tiles.
+
+        Parameters
+        ----------
+        N : int
+            Number of time series.
+
+        Returns
+        -------
+        tiles : list of tuples
+            Tile bounds ordered by decreasing number of pairs.
+        """
+
+        tiles = []
+        for i in range(0, N, self.tile_size):
+            for j in range(i, N, self.tile_size):
+                tiles.append((i, min(i + self.tile_size, N), j, min(j + self.tile_size, N)))
+
+        # diagonal tiles hold half of the pairs, so schedule the full ones first
+        tiles.sort(key=lambda tile: tile[0] == tile[2])
+
+        return tiles
+
+
+    def _update(self, pairs_num):
+        """
+        Update the progress counters after a finished tile.
+        """
+
+        self.pairs_done += pairs_num
+        self.elapsed_time = time.perf_counter() - self._start_time
+        if self.callback is not None:
+            self.callback(self)
+
+
+    def compute(self, data):
+        """
+        Compute the DTW distance matrix.
+
+        Parameters
+        ----------
+        data : numpy.ndarray (2d array of shape (ts_number, ts_length))
+            Time series set.
+
+        Returns
+        -------
+        condensed : numpy.ndarray (1d array of shape (ts_number*(ts_number-1)/2,))
+            The condensed distance matrix (see scipy.spatial.distance.squareform).
+        """
+
+        data = np.asarray(data, dtype=np.float64)
+        N = data.shape[0]
+        tiles = self._tiles(N)
+
+        self.pairs_total = N*(N-1) // 2
+        self.pairs_done = 0
+        self.elapsed_time = 0.0
+        self._start_time = time.perf_counter()
+
+        if self.n_jobs == 1:
+            condensed = np.empty(self.pairs_total, dtype=np.float64)
+            for tile in tiles:
+                self._update(_DTW_tile(tile, data, condensed, self.r))
+            return condensed
+
+        data_shm, shared_data = create_shared_array(data.shape, data=data)
+        condensed_shm, shared_condensed = create_shared_array((self.pairs_total,))
+        specs = {'data': (data_shm.name, data.shape, shared_data.dtype.str),
+                 'condensed': (condensed_shm.name, (self.pairs_total,), shared_condensed.dtype.str)}
+
+        try:
+            with Pool(self.n_jobs, initializer=_init_worker, initargs=(specs,)) as pool:
+                worker = partial(_DTW_tile_worker, r=self.r)
+                for pairs_num in pool.imap_unordered(worker, tiles):
+                    self._update(pairs_num)
+            condensed = shared_condensed.copy()
+        finally:
+            del shared_data, shared_condensed
+            release_shared_arrays([data_shm, condensed_shm])
+
+        return condensed
+
+
+def _assign_chunk(bounds, data, labels, distances, centers, r):
+    """
+    Assign the time series of the chunk to the nearest centers by DTW distance.
+
+    The centers are visited in the order of their LB_Kim/LB_Keogh lower bounds,
+    DTW is early abandoned at the best-so-far distance and the centers
+    whose lower bound is not less than the best-so-far are skipped.
+
+    Parameters
+    ----------
+    bounds : tuple of int
+        (start, stop) of the chunk in the time series set.
+
+    data : numpy.ndarray (2d array of shape (ts_number, ts_length))
+        Time series set.
+
+    labels : numpy.ndarray
+        Array to write the indices of the nearest centers into.
+
+    distances : numpy.ndarray
+        Array to write the DTW distances to the nearest centers into.
+
+    centers : numpy.ndarray (2d array of shape (n_clusters, ts_length))
+        The centers.
+
+    r : float
+        Warping window size.
+
+    Returns
+    -------
+    counters : numpy.ndarray
+        Number of the computed and of the pruned DTW distances.
+    """
+
+    start, stop = bounds
+    w = _DTW_window(data.shape[1], centers.shape[1], r)
+    upper, lower = envelope(centers, w)
+
+    chunk = np.asarray(data[start:stop], dtype=np.float64)
+    lower_bound = LB_Kim_by_features(Kim_features(chunk)[:, np.newaxis], Kim_features(centers)[np.newaxis])
+    for c in range(centers.shape[0]):
+        lower_bound[:, c] = np.maximum(lower_bound[:, c], LB_Keogh(chunk, upper[c], lower[c]))
+
+    dtw_num = 0
+    for i in range(chunk.shape[0]):
+        best_dist = np.inf
+        best_label = 0
+        for c in np.argsort(lower_bound[i], kind='stable'):
+            if lower_bound[i, c] >= best_dist:
+                break
+            dist = _DTW_band(chunk[i], centers[c], w, best_dist)
+            dtw_num += 1
+            if dist < best_dist:
+                best_dist = dist
+                best_label = c
+        labels[start+i] = best_label
+        distances[start+i] = best_dist
+
+    return np.array([dtw_num, chunk.shape[0]*centers.shape[0] - dtw_num], dtype=np.int64)
+
+
+@njit(cache=True)
+def _DBA_accumulate(data, labels, centers, w, start, stop, sums, counts):
+    """
+    Add the time series values aligned by DTW with each point of their centers
+    to the sums and counts of the DBA update.
+    """
+
+    for i in range(start, stop):
+        c = labels[i]
+        _, path = _DTW_band_path(centers[c], data[i], w)
+        for p in range(path.shape[0]):
+            sums[c, path[p, 0]] += data[i, path[p, 1]]
+            counts[c, path[p, 0]] += 1
+
+
+def _DBA_chunk(bounds, data, labels, centers, r):
+    """
+    Compute the DBA sums and counts of the chunk.
+
+    Parameters
+    ----------
+    bounds : tuple of int
+        (start, stop) of the chunk in the time series set.
+
+    data : numpy.ndarray (2d array of shape (ts_number, ts_length))
+        Time series set.
+
+    labels : numpy.ndarray
+        Indices of the centers of time series.
+
+    centers : numpy.ndarray (2d array of shape (n_clusters, ts_length))
+        The centers.
+
+    r : float
+        Warping window size.
+
+    Returns
+    -------
+    sums : numpy.ndarray
+        Sums of the values aligned with each point of the centers.
+
+    counts : numpy.ndarray
+        Numbers of the values aligned with each point of the centers.
+    """
+
+    start, stop = bounds
+    w = _DTW_window(centers.shape[1], data.shape[1], r)
+
+    sums = np.zeros(centers.shape)
+    counts = np.zeros(centers.shape)
+    _DBA_accumulate(data, labels, centers, w, start, stop, sums, counts)
+
+    return sums, counts
+
+
+def _assign_chunk_worker(bounds, centers, r):
+    """
+    Pool task: assign a chunk of the shared time series set to the centers.
+    """
+
+    return _assign_chunk(bounds, _worker_arrays['data'], _worker_arrays['labels'],
+                         _worker_arrays['distances'], centers, r)
+
+
+def _DBA_chunk_worker(bounds, centers, r):
+    """
+    Pool task: compute the DBA sums and counts of a chunk of the shared time series set.
+    """
+
+    return _DBA_chunk(bounds, _worker_arrays['data'], _worker_arrays['labels'], centers, r)
+
+
+class ParallelCenterAssignment:
+    """
+    Parallel assignment of time series to the nearest centers (medoids or centroids)
+    by DTW distance with lower bounds, and DBA update of the centroids.
+
+    The time series set, labels and distances are placed in shared memory once,
+    so every pass sends only chunk bounds and the centers to the worker pool,
+    and the memory is linear in the number of time series. The object has to be
+    closed (or used as a context manager) to release the pool and shared memory.
+
+    Parameters
+    ----------
+    data : numpy.ndarray (2d array of shape (ts_number, ts_length))
+        Time series set.
+
+    r : float, default = None
+        Warping window size.
+
+    n_jobs : int, default = None
+        Number of worker processes. If None, the number of CPUs is used.
+
+    chunk_size : int, default = 256
+        Number of time series in a task.
+    """
+
+    def __init__(self, data, r=None, n_jobs=None, chunk_size=256):
+
+        self.r = r
+        self.n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+        self.chunk_size = chunk_size
+
+        data = np.asarray(data, dtype=np.float64)
+        N = data.shape[0]
+        self.chunks = [(start, min(start + chunk_size, N)) for start in range(0, N, chunk_size)]
+
+        self.dtw_num = 0
+        self.pruned_num = 0
+
+        self._pool = None
+        self._blocks = []
+        if self.n_jobs == 1:
+            self.data = data
+            self.labels = np.zeros(N, dtype=np.int64)
+            self.distances = np.zeros(N, dtype=np.float64)
+            return
+
+        specs = {}
+        for key, values in (('data', data), ('labels', np.zeros(N, dtype=np.int64)), ('distances', np.zeros(N))):
+            shm, a = create_shared_array(values.shape, values.dtype, values)
+            self._blocks.append(shm)
+            setattr(self, key, a)
+            specs[key] = (shm.name, a.shape, a.dtype.str)
+
+        self._pool = Pool(self.n_jobs, initializer=_init_worker, initargs=(specs,))
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+
+    def close(self):
+        """
+        Stop the worker pool and release the shared memory.
+        """
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        if self._blocks:
+            del self.data, self.labels, self.distances
+            release_shared_arrays(self._blocks)
+            self._blocks = []
+
+
+    def assign(self, centers):
+        """
+        Assign time series to the nearest centers.
+
+        Parameters
+        ----------
+        centers : numpy.ndarray (2d array of shape (n_clusters, ts_length))
+            The centers.
+
+        Returns
+        -------
+        labels : numpy.ndarray
+            Indices of the nearest centers.
+
+        distances : numpy.ndarray
+            DTW distances to the nearest centers.
+        """
+
+        centers = np.asarray(centers, dtype=np.float64)
+
+        if self._pool is None:
+            results = [_assign_chunk(bounds, self.data, self.labels, self.distances, centers, self.r) for bounds in self.chunks]
+        else:
+            results = self._pool.map(partial(_assign_chunk_worker, centers=centers, r=self.r), self.chunks)
+
+        counters = np.sum(results, axis=0)
+        self.dtw_num += int(counters[0])
+        self.pruned_num += int(counters[1])
+
+        return self.labels.copy(), self.distances.copy()
+
+
+    def DBA_update(self, centers):
+        """
+        Perform one iteration of DTW Barycenter Averaging (DBA) of the clusters
+        given by the last assignment: each point of a centroid is replaced with
+        the mean of the time series values aligned with it.
+
+        Parameters
+        ----------
+        centers : numpy.ndarray (2d array of shape (n_clusters, ts_length))
+            The centroids used in the last assignment.
+
+        Returns
+        -------
+        new_centers : numpy.ndarray
+            The updated centroids (the centroids of empty clusters are not changed).
+        """
+
+        centers = np.asarray(centers, dtype=np.float64)
+
+        if self._pool is None:
+            results = [_DBA_chunk(bounds, self.data, self.labels, centers, self.r) for bounds in self.chunks]
+        else:
+            results = self._pool.map(partial(_DBA_chunk_worker, centers=centers, r=self.r), self.chunks)
+
+        sums = np.sum([result[0] for result in results], axis=0)
+        counts = np.sum([result[1] for result in results], axis=0)
+
+        new_centers = centers.copy()
+        np.divide(sums, counts, out=new_centers, where=counts > 0)
+
+        return new_centers
@@ -1,5 +1,5 @@
 import numpy as np
-import math
+from numba import njit
 
 
 def z_normalize(ts):
@@ -23,7 +23,50 @@ def z_normalize(ts):
     return norm_ts
 
 
-def sliding_window(ts, window, step=1):
+def batch_z_normalize(subs_matrix, out=None, dtype=np.float64, mean=None, std=None):
+    """
+    Z-normalize every row of the subsequence matrix in one vectorized pass.
+
+    Parameters
+    ----------
+    subs_matrix : numpy.ndarray (2d array of shape (subs_number, subs_length))
+        Matrix of subsequences.
+
+    out : numpy.ndarray, default = None
+        Array to write the result into. Passing subs_matrix itself normalizes it in-place.
+
+    dtype : numpy.dtype, default = numpy.float64
+        Type of the result if out is None (e.g. numpy.float32).
+
+    mean : numpy.ndarray, default = None
+        Precomputed means of the rows (e.g. from sliding_stats).
+
+    std : numpy.ndarray, default = None
+        Precomputed standard deviations of the rows (e.g. from sliding_stats).
+
+    Returns
+    -------
+    norm_matrix : numpy.ndarray
+        Matrix of the z-normalized subsequences. The constant subsequences
+        are turned into zero rows.
+    """
+
+    if mean is None:
+        mean = np.mean(subs_matrix, axis=1)
+    if std is None:
+        std = np.std(subs_matrix, axis=1)
+    if out is None:
+        out = np.empty(np.shape(subs_matrix), dtype=dtype)
+
+    std = np.where(std > 0, std, 1)
+
+    np.subtract(subs_matrix, np.asarray(mean)[:, np.newaxis], out=out)
+    out /= np.asarray(std, dtype=out.dtype)[:, np.newaxis]
+
+    return out
+
+
+def sliding_window(ts, window, step=1, copy=False):
     """
     Extract subsequences from time series using sliding window.
 
@@ -38,20 +81,270 @@ def sliding_window(ts, window, step=1):
     step : int
         Step of the sliding window.
 
+    copy : bool, default = False
+        If False, return a read-only strided view on the time series
+        (no data is copied). If True, return a new matrix of subsequences.
+
     Returns
     -------
     subs_matrix : numpy.ndarray
         Matrix of subsequences.
     """
-    
-    n = ts.shape[0]
-    N = math.ceil((n-window+1)/step)
 
-    subs_matrix = np.zeros((N, window))
+    ts = np.asarray(ts)
+
+    subs_matrix = np.lib.stride_tricks.sliding_window_view(ts, window)[::step]
 
-    for i in range(N):
-        start_idx = i*step
-        end_idx = start_idx + window
-        subs_matrix[i] = ts[start_idx:end_idx]
+    if copy:
+        subs_matrix = np.array(subs_matrix, dtype=np.float64)
 
     return subs_matrix
+
+
+@njit(cache=True)
+def _envelope(ts, w, upper, lower):
+    """
+    Compute the warping envelopes of the rows of time series set with Lemire's
+    streaming min/max algorithm: the candidate maximums (minimums) of the window are
+    kept in a monotone deque, so every point is pushed and popped once, O(n) per row.
+    """
+
+    n = ts.shape[1]
+    max_deque = np.empty(n, dtype=np.int64)
+    min_deque = np.empty(n, dtype=np.int64)
+
+    for row in range(ts.shape[0]):
+        x = ts[row]
+        max_head = max_tail = 0
+        min_head = min_tail = 0
+
+        for j in range(n + w):
+            if j < n and not np.isnan(x[j]):
+                # the points dominated by x[j] can not be the window maximum (minimum) anymore
+                while max_tail > max_head and x[max_deque[max_tail-1]] <= x[j]:
+                    max_tail -= 1
+                max_deque[max_tail] = j
+                max_tail += 1
+                while min_tail > min_head and x[min_deque[min_tail-1]] >= x[j]:
+                    min_tail -= 1
+                min_deque[min_tail] = j
+                min_tail += 1
+
+            # the window [i-w, i+w] of the point i is complete
+            i = j - w
+            if i < 0:
+                continue
+            while max_tail > max_head and max_deque[max_head] < i - w:
+                max_head += 1
+            while min_tail > min_head and min_deque[min_head] < i - w:
+                min_head += 1
+            upper[row, i] = x[max_deque[max_head]] if max_tail > max_head else np.nan
+            lower[row, i] = x[min_deque[min_head]] if min_tail > min_head else np.nan
+
+
+def envelope(ts, w):
+    """
+    Compute the upper and lower warping envelopes of time series.
+
+    The envelopes are the maximum and minimum of the points within w positions
+    from each point. Time series sets (2d arrays, e.g. a sliding window view of
+    candidate subsequences) are processed row by row. The envelopes are computed
+    in O(n) regardless of w. NaN values are skipped.
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series (or time series set).
+
+    w : int
+        Half-width of the warping window (in points).
+
+    Returns
+    -------
+    upper : numpy.ndarray
+        The upper envelope.
+
+    lower : numpy.ndarray
+        The lower envelope.
+    """
+
+    ts = np.asarray(ts, dtype=np.float64)
+    rows = ts.reshape(-1, ts.shape[-1])
+
+    upper = np.empty(rows.shape)
+    lower = np.empty(rows.shape)
+    _envelope(rows, int(w), upper, lower)
+
+    return upper.reshape(ts.shape), lower.reshape(ts.shape)
+
+
+@njit(cache=True)
+def _sliding_stats(ts, m, mu, sigma):
+    """
+    Fill the sliding means and standard deviations of the time series.
+
+    The statistics are updated with the sliding form of Welford's recurrence.
+    The recurrence is restarted every m windows, so the rounding error does not
+    accumulate along long time series. Windows containing non-finite values get
+    mean np.inf and standard deviation np.nan.
+    """
+
+    N = ts.shape[0] - m + 1
+    finite = np.isfinite(ts)
+    x = np.where(finite, ts, 0.0)
+
+    mean = 0.0
+    M2 = 0.0
+    nonfinite_num = 0
+
+    for k in range(N):
+        if k % m == 0:
+            mean = 0.0
+            M2 = 0.0
+            nonfinite_num = 0
+            for t in range(m):
+                delta = x[k+t] - mean
+                mean += delta / (t+1)
+                M2 += delta * (x[k+t] - mean)
+                if not finite[k+t]:
+                    nonfinite_num += 1
+        else:
+            x_out = x[k-1]
+            x_in = x[k+m-1]
+            prev_mean = mean
+            mean = prev_mean + (x_in - x_out) / m
+            M2 += (x_in - x_out) * (x_in - mean + x_out - prev_mean)
+            if not finite[k-1]:
+                nonfinite_num -= 1
+            if not finite[k+m-1]:
+                nonfinite_num += 1
+
+        if nonfinite_num > 0:
+            mu[k] = np.inf
+            sigma[k] = np.nan
+        else:
+            mu[k] = mean
+            sigma[k] = np.sqrt(max(M2, 0.0) / m)
+
+
+def sliding_stats(ts, m):
+    """
+    Calculate the means and standard deviations of all subsequences of time series
+    in one pass.
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series.
+
+    m : int
+        Subsequence length.
+
+    Returns
+    -------
+    mu : numpy.ndarray
+        Means of subsequences.
+
+    sigma : numpy.ndarray
+        Standard deviations of subsequences.
+    """
+
+    ts = np.asarray(ts, dtype=np.float64)
+    N = ts.shape[0] - m + 1
+
+    mu = np.empty(N, dtype=np.float64)
+    sigma = np.empty(N, dtype=np.float64)
+    _sliding_stats(ts, m, mu, sigma)
+
+    return mu, sigma
+
+
+class SlidingStats:
+    """
+    Mean and standard deviation of the last m points of a streaming time series.
+
+    Parameters
+    ----------
+    m : int
+        Subsequence length.
+    """
+
+    def __init__(self, m):
+
+        self.m = m
+        self._window = np.zeros(m, dtype=np.float64)
+        self._count = 0
+        self._mean = 0.0
+        self._M2 = 0.0
+
+
+    def _restart(self):
+        """
+        Recompute the statistics of the current window from scratch.
+        """
+
+        self._mean = np.mean(self._window)
+        self._M2 = np.sum((self._window - self._mean) ** 2)
+
+
+    def update(self, value):
+        """
+        Append a point to the stream.
+
+        Parameters
+        ----------
+        value : float
+            The new point of time series.
+
+        Returns
+        -------
+        mu : float
+            Mean of the last m points (np.nan until m points are received).
+
+        sigma : float
+            Standard deviation of the last m points (np.nan until m points are received).
+        """
+
+        pos = self._count % self.m
+        x_out = self._window[pos]
+        self._window[pos] = value
+        self._count += 1
+
+        if self._count <= self.m:
+            delta = value - self._mean
+            self._mean += delta / self._count
+            self._M2 += delta * (value - self._mean)
+            if self._count < self.m:
+                return np.nan, np.nan
+        elif pos == self.m - 1:
+            # restart the recurrence once per window to cancel rounding drift
+            self._restart()
+        else:
+            prev_mean = self._mean
+            self._mean = prev_mean + (value - x_out) / self.m
+            self._M2 += (value - x_out) * (value - self._mean + x_out - prev_mean)
+
+        return self._mean, np.sqrt(max(self._M2, 0.0) / self.m)
+
+
+    def extend(self, values):
+        """
+        Append points to the stream.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            The new points of time series.
+
+        Returns
+        -------
+        mu : numpy.ndarray
+            Means of the windows ending at each new point.
+
+        sigma : numpy.ndarray
+            Standard deviations of the windows ending at each new point.
+        """
+
+        stats = np.array([self.update(value) for value in values], dtype=np.float64).reshape(-1, 2)
+
+        return stats[:, 0], stats[:, 1]
@@ -1,8 +1,13 @@
 import numpy as np
 import copy
+import os
+from multiprocessing import Pool
+from numba import njit
 
 from modules.utils import *
 from modules.metrics import *
+from modules.metrics import _DTW_window
+from modules.parallel import share_arrays, attach_shared_arrays, release_shared_arrays, split_range
 
 
 class BestMatchFinder:
@@ -15,7 +20,8 @@ class BestMatchFinder:
         Query.
     
     ts : numpy.ndarrray
-        Time series.
+        Time series (or time series set). The subsequences of a time series
+        are taken as a read-only sliding window view.
     
     excl_zone_denom : float, default = 1
         The exclusion zone.
@@ -35,8 +41,13 @@ class BestMatchFinder:
         self.query = copy.deepcopy(np.array(query))
         if (len(np.shape(ts)) == 2): # time series set
             self.ts = ts
+            self.ts_values = None
+            self.ts_mean = np.mean(ts, axis=1)
+            self.ts_std = np.std(ts, axis=1)
         else:
             self.ts = sliding_window(ts, len(query))
+            self.ts_values = np.asarray(ts)
+            self.ts_mean, self.ts_std = sliding_stats(ts, len(query))
 
         self.excl_zone_denom = exclusion_zone
         self.top_k = top_k
@@ -44,6 +55,36 @@ class BestMatchFinder:
         self.r = r
 
 
+    def _subsequence_blocks(self, block_size=1024):
+        """
+        Iterate over the subsequences block by block.
+
+        If normalize is True, the blocks are z-normalized using the precomputed
+        statistics into one reusable buffer.
+
+        Parameters
+        ----------
+        block_size : int, default = 1024
+            Number of subsequences in a block.
+
+        Returns
+        -------
+        blocks : generator of tuples (int, numpy.ndarrray)
+            Index of the first subsequence of block and the block.
+        """
+
+        N, m = self.ts.shape
+        buffer = np.empty((min(block_size, N), m))
+
+        for start in range(0, N, block_size):
+            stop = min(start + block_size, N)
+            if self.normalize:
+                yield start, batch_z_normalize(self.ts[start:stop], out=buffer[:stop-start],
+                                               mean=self.ts_mean[start:stop], std=self.ts_std[start:stop])
+            else:
+                yield start, np.asarray(self.ts[start:stop], dtype=np.float64)
+
+
     def _apply_exclusion_zone(self, a, idx, excl_zone):
         """
         Apply an exclusion zone to an array (inplace).
@@ -96,24 +137,9 @@ class BestMatchFinder:
             Dictionary containing results of algorithm.
         """
         
-        data_len = len(distances)
-        top_k_match = []
-
-        distances = np.copy(distances)
-        top_k_match_idx = []
-        top_k_match_dist = []
-
-        for i in range(self.top_k):
-            min_idx = np.argmin(distances)
-            min_dist = distances[min_idx]
-
-            if (np.isnan(min_dist)) or (np.isinf(min_dist)) or (min_dist > bsf):
-                break
-
-            distances = self._apply_exclusion_zone(distances, min_idx, excl_zone)
-
-            top_k_match_idx.append(min_idx)
-            top_k_match_dist.append(min_dist)
+        top_k_match_idx, top_k_match_dist = top_k_with_exclusion(distances, self.top_k, excl_zone, bound=bsf)
+        top_k_match_idx = list(top_k_match_idx)
+        top_k_match_dist = list(top_k_match_dist)
 
         return {'index': top_k_match_idx, 'distance': top_k_match_dist}
 
@@ -153,36 +179,338 @@ class NaiveBestMatchFinder(BestMatchFinder):
         # INSERT YOUR CODE
         dist_list = []
         r = self.r
-        data = copy.deepcopy(self.ts)
+        data = self.ts
         qery_len = len(self.query)
         bsf = float("inf")
-        query = z_normalize(self.query)
-        #print(N,m,excl_zone,self.excl_zone_denom)
-        for i in range(0,N - qery_len,self.excl_zone_denom):
-          #print(self.query)
-          #print(data[i:i+qery_len][0])
-          
-          dist = DTW_distance(query, z_normalize(data[i:i+qery_len][0]), r)
-          if dist < bsf:
-            bsf = dist
-            dist_list.append(bsf)
-          else: 
-            dist_list.append(dist)
-
-        print(dist_list)
+        query = z_normalize(self.query) if self.normalize else self.query
+        for start, C_block in self._subsequence_blocks():
+          for C in C_block:
+            dist = DTW_distance(query, C, r)
+            if dist < bsf:
+              bsf = dist
+              dist_list.append(bsf)
+            else: 
+              dist_list.append(dist)
+
         bsf = float("inf")
         self.bestmatch = self._top_k_match( dist_list, m, bsf, excl_zone)
         return self.bestmatch
 
 
+@njit(cache=True)
+def _LB_Kim_hierarchy(q, c, bsf):
+    """
+    Compute LB_Kim lower bound from the first and last points (UCR suite version):
+    the cells (0, 0) and (m-1, m-1) are on every warping path, and so is one of
+    the three cells next to each of them. The bound grows level by level
+    while it is less than best-so-far.
+    """
+
+    m = q.shape[0]
+
+    lb = (c[0] - q[0]) ** 2
+    if m > 1:
+        lb += (c[m-1] - q[m-1]) ** 2
+    if lb >= bsf or m < 4:
+        return lb
+
+    lb += min((c[1] - q[0]) ** 2, (c[0] - q[1]) ** 2, (c[1] - q[1]) ** 2)
+    if lb >= bsf:
+        return lb
+    lb += min((c[m-2] - q[m-1]) ** 2, (c[m-1] - q[m-2]) ** 2, (c[m-2] - q[m-2]) ** 2)
+    if lb >= bsf or m < 6:
+        return lb
+
+    lb += min((c[2] - q[0]) ** 2, (c[2] - q[1]) ** 2, (c[2] - q[2]) ** 2, (c[1] - q[2]) ** 2, (c[0] - q[2]) ** 2)
+    if lb >= bsf:
+        return lb
+    lb += min((c[m-3] - q[m-1]) ** 2, (c[m-3] - q[m-2]) ** 2, (c[m-3] - q[m-3]) ** 2,
+              (c[m-2] - q[m-3]) ** 2, (c[m-1] - q[m-3]) ** 2)
+
+    return lb
+
+
+@njit(cache=True)
+def _LB_Keogh_cumulative(x, upper, lower, order, bsf, cb):
+    """
+    Compute LB_Keogh lower bound visiting the points in the given order
+    (the largest contributions first) and abandon it as soon as it reaches best-so-far.
+    The contribution of each point is stored into cb.
+    """
+
+    lb = 0.0
+    for k in range(order.shape[0]):
+        if lb >= bsf:
+            break
+        i = order[k]
+        d = 0.0
+        if x[i] > upper[i]:
+            d = (x[i] - upper[i]) ** 2
+        elif x[i] < lower[i]:
+            d = (x[i] - lower[i]) ** 2
+        cb[i] = d
+        lb += d
+
+    return lb
+
+
+@njit(cache=True)
+def _LB_Keogh_normalized(values, pos, mu, inv_sigma, upper, lower, order, bsf, cb, c):
+    """
+    Compute LB_Keogh lower bound of the subsequence values[pos : pos+m] z-normalized
+    on the fly (like _LB_Keogh_cumulative). The normalized points are stored into c,
+    so c holds the whole normalized subsequence unless the bound is abandoned.
+    """
+
+    lb = 0.0
+    for k in range(order.shape[0]):
+        if lb >= bsf:
+            break
+        i = order[k]
+        x = (values[pos+i] - mu) * inv_sigma
+        c[i] = x
+        d = 0.0
+        if x > upper[i]:
+            d = (x - upper[i]) ** 2
+        elif x < lower[i]:
+            d = (x - lower[i]) ** 2
+        cb[i] = d
+        lb += d
+
+    return lb
+
+
+@njit(cache=True)
+def _DTW_band_cumulative(q, c, w, cb_cum, bsf):
+    """
+    Compute DTW distance inside the Sakoe-Chiba band (like metrics._DTW_band)
+    and abandon it as soon as the minimum of a row plus the lower bound of the
+    points not reachable from this row (cb_cum) reaches best-so-far.
+    """
+
+    m = q.shape[0]
+    width = 2*w + 3
+
+    prev = np.full(width, np.inf)
+    curr = np.full(width, np.inf)
+    prev[w+1] = 0.0
+
+    for i in range(1, m+1):
+        curr[:] = np.inf
+        row_min = np.inf
+        for j in range(max(1, i-w), min(m, i+w) + 1):
+            k = j - i + w + 1
+            best = prev[k]
+            if prev[k+1] < best:
+                best = prev[k+1]
+            if curr[k-1] < best:
+                best = curr[k-1]
+            curr[k] = (q[i-1] - c[j-1]) ** 2 + best
+            if curr[k] < row_min:
+                row_min = curr[k]
+
+        rest = cb_cum[i+w] if i + w < m else 0.0
+        if row_min + rest >= bsf:
+            return np.inf
+
+        prev, curr = curr, prev
+
+    return prev[w+1]
+
+
+@njit(cache=True)
+def _update_top_k(top_dist, top_idx, dist, idx, min_gap):
+    """
+    Insert the match into the current top-k whose members are more than min_gap apart.
+
+    The match replaces the only member closer than min_gap if it is better, and is
+    skipped if it conflicts with several members. So the k-th distance never increases,
+    and k matches at least that close exist which the exclusion zones can not suppress.
+    """
+
+    k = top_dist.shape[0]
+    conflict = -1
+    for p in range(k):
+        if top_idx[p] >= 0 and abs(top_idx[p] - idx) <= min_gap:
+            if conflict >= 0 or top_dist[p] <= dist:
+                return
+            conflict = p
+
+    # the replaced member or the worst one makes room for the match
+    p = conflict if conflict >= 0 else k - 1
+    if dist >= top_dist[p]:
+        return
+    while p > 0 and top_dist[p-1] > dist:
+        top_dist[p] = top_dist[p-1]
+        top_idx[p] = top_idx[p-1]
+        p -= 1
+    top_dist[p] = dist
+    top_idx[p] = idx
+
+
+@njit(cache=True)
+def _merge_top_k(top_dist, top_idx, distances, index_offset, min_gap):
+    """
+    Insert the subsequences closer than the best-so-far into the current top-k
+    (see _update_top_k) in the order of increasing distance.
+    """
+
+    for i in np.argsort(distances):
+        if distances[i] >= top_dist[top_dist.shape[0] - 1]:
+            break
+        _update_top_k(top_dist, top_idx, distances[i], i + index_offset, min_gap)
+
+
+@njit(cache=True)
+def _LB_Kim_normalized(values, pos, m, mu, inv_sigma, query, c, bsf):
+    """
+    Compute LB_Kim lower bound (see _LB_Kim_hierarchy) of the subsequence
+    values[pos : pos+m]. Only its first and last points are z-normalized (into c).
+    """
+
+    for j in range(min(3, m)):
+        c[j] = (values[pos+j] - mu) * inv_sigma
+    for j in range(max(m-3, 0), m):
+        c[j] = (values[pos+j] - mu) * inv_sigma
+
+    return _LB_Kim_hierarchy(query, c, bsf)
+
+
+@njit(cache=True)
+def _UCR_candidate(values, pos, m, query, q_upper, q_lower, order, upper, lower, mu, inv_sigma,
+                   w, bsf, c, cb1, cb2, cb_cum, counters):
+    """
+    Compute DTW distance between the query and the subsequence values[pos : pos+m]
+    which is not pruned by LB_Kim (see _LB_Kim_normalized), or return np.inf
+    if the subsequence is pruned by the other lower bounds.
+
+    The points of the subsequence (and its envelope taken from the envelope of values)
+    are z-normalized on the fly with its mean and standard deviation, only when
+    a lower bound needs them. The subsequence is pruned by LB_Keogh with the query
+    envelope and by LB_Keogh with its own envelope; otherwise DTW is computed with
+    early abandoning by the cumulative LB_Keogh contributions. c, cb1, cb2 and cb_cum
+    are work buffers of length m.
+
+    counters : [lb_Kim_num, lb_KeoghQC_num, lb_KeoghCQ_num, dtw_num].
+    """
+
+    lb_QC = _LB_Keogh_normalized(values, pos, mu, inv_sigma, q_upper, q_lower, order, bsf, cb1, c)
+    if lb_QC >= bsf:
+        counters[1] += 1
+        return np.inf
+
+    c_upper = (upper[pos:pos+m] - mu) * inv_sigma
+    c_lower = (lower[pos:pos+m] - mu) * inv_sigma
+    lb_CQ = _LB_Keogh_cumulative(query, c_upper, c_lower, order, bsf, cb2)
+    if lb_CQ >= bsf:
+        counters[2] += 1
+        return np.inf
+
+    # the remaining DTW cost is bounded by the contributions of the tighter lower bound
+    cb = cb1 if lb_QC > lb_CQ else cb2
+    total = 0.0
+    for j in range(m-1, -1, -1):
+        total += cb[j]
+        cb_cum[j] = total
+
+    counters[3] += 1
+
+    return _DTW_band_cumulative(query, c, w, cb_cum, bsf)
+
+
+@njit(cache=True)
+def _UCR_scan(values, stride, m, query, q_upper, q_lower, order, upper, lower, mu, sigma,
+              w, start, stop, top_dist, top_idx, min_gap, index_offset, shared_bsf, slot, distances, counters):
+    """
+    Scan the subsequences [start, stop) with the UCR suite (see _UCR_candidate).
+
+    The subsequence i is values[i*stride : i*stride+m]. The best-so-far is the
+    k-th distance of the current top-k, which stores the subsequence indices shifted
+    by index_offset (e.g. the start of the scanned chunk of a longer time series).
+    The best-so-far is also tightened by the thresholds published by other scans
+    into shared_bsf (a scan writes its own threshold into shared_bsf[slot]).
+
+    counters : [lb_Kim_num, lb_KeoghQC_num, lb_KeoghCQ_num, dtw_num].
+    """
+
+    c = np.empty(m)
+    cb1 = np.zeros(m)
+    cb2 = np.zeros(m)
+    cb_cum = np.empty(m)
+
+    for i in range(start, stop):
+        distances[i] = np.inf
+        if not np.isfinite(mu[i]):
+            continue
+
+        bsf = min(top_dist[top_dist.shape[0] - 1], np.min(shared_bsf))
+        inv_sigma = 1.0 / sigma[i] if sigma[i] > 0 else 0.0
+        if _LB_Kim_normalized(values, i*stride, m, mu[i], inv_sigma, query, c, bsf) >= bsf:
+            counters[0] += 1
+            continue
+
+        dist = _UCR_candidate(values, i*stride, m, query, q_upper, q_lower, order, upper, lower,
+                              mu[i], inv_sigma, w, bsf, c, cb1, cb2, cb_cum, counters)
+        distances[i] = dist
+        if dist < bsf:
+            _update_top_k(top_dist, top_idx, dist, i + index_offset, min_gap)
+            shared_bsf[slot] = top_dist[top_dist.shape[0] - 1]
+
+
+@njit(cache=True)
+def _multi_UCR_scan(values, uppers, lowers, env_group, mus, sigmas, stats_group, queries, lengths,
+                    q_uppers, q_lowers, orders, ws, start, stop, top_dist, top_idx, min_gaps, distances, counters):
+    """
+    Scan the positions [start, stop) of time series once for all queries: the lower bounds
+    (and, if needed, DTW) of every query are evaluated for a position before moving on.
+
+    The queries, their envelopes and orders are rows padded to the longest query (lengths
+    holds the real ones). The query q uses the envelope of time series uppers[env_group[q]]
+    and the statistics mus[stats_group[q]] (np.inf beyond the last subsequence).
+    Every query has its own top-k (top_dist[q], top_idx[q]) and counters[q].
+    distances[q, i-start] gets the distance of the subsequence i.
+    """
+
+    max_m = queries.shape[1]
+    c = np.empty(max_m)
+    cb1 = np.zeros(max_m)
+    cb2 = np.zeros(max_m)
+    cb_cum = np.empty(max_m)
+    k = top_dist.shape[1]
+
+    for i in range(start, stop):
+        for q in range(queries.shape[0]):
+            distances[q, i-start] = np.inf
+            mu = mus[stats_group[q], i]
+            if not np.isfinite(mu):
+                continue
+
+            m = lengths[q]
+            bsf = top_dist[q, k-1]
+            sigma = sigmas[stats_group[q], i]
+            inv_sigma = 1.0 / sigma if sigma > 0 else 0.0
+            if _LB_Kim_normalized(values, i, m, mu, inv_sigma, queries[q, :m], c, bsf) >= bsf:
+                counters[q, 0] += 1
+                continue
+
+            dist = _UCR_candidate(values, i, m, queries[q, :m], q_uppers[q, :m], q_lowers[q, :m], orders[q, :m],
+                                  uppers[env_group[q]], lowers[env_group[q]], mu, inv_sigma,
+                                  ws[q], bsf, c[:m], cb1[:m], cb2[:m], cb_cum[:m], counters[q])
+            distances[q, i-start] = dist
+            if dist < bsf:
+                _update_top_k(top_dist[q], top_idx[q], dist, i, min_gaps[q])
+
+
 class UCR_DTW(BestMatchFinder):
     """
     UCR-DTW Match Finder.
     """
     
-    def __init__(self, ts=None, query=None, exclusion_zone=1, top_k=3, normalize=True, r=0.05):
+    def __init__(self, ts=None, query=None, exclusion_zone=1, top_k=3, normalize=True, r=0.05, n_jobs=1):
         super().__init__(ts, query, exclusion_zone, top_k, normalize, r)
 
+        self.n_jobs = n_jobs
+
 
     def _LB_Kim(self, subs1, subs2):
         """
@@ -206,12 +534,13 @@ class UCR_DTW(BestMatchFinder):
 
         # INSERT YOUR CODE
 
-        lb_Kim =  ((subs1[0] - subs2[0]) ** 2 + (subs1[-1] - subs2[-1]) ** 2) ** 0.5
+        # squared like DTW_distance, so the bound is comparable with DTW distances
+        lb_Kim =  (subs1[0] - subs2[0]) ** 2 + (subs1[-1] - subs2[-1]) ** 2
    
         return lb_Kim
 
 
-    def _LB_Keogh(self, subs1, subs2, r):
+    def _LB_Keogh(self, subs1, subs2, r, upper=None, lower=None):
         """
         Compute LB_Keogh lower bound between two subsequences.
         
@@ -225,6 +554,12 @@ class UCR_DTW(BestMatchFinder):
         
         r : float
             Warping window size.
+
+        upper : numpy.ndarrray, default = None
+            Precomputed upper envelope of subs2 (e.g. taken from the envelope of time series).
+
+        lower : numpy.ndarrray, default = None
+            Precomputed lower envelope of subs2.
         
         Returns
         -------
@@ -232,32 +567,170 @@ class UCR_DTW(BestMatchFinder):
             LB_Keogh lower bound.
         """
         
-        lb_Keogh = 0
+        if upper is None or lower is None:
+            m = np.shape(subs2)[0]
+            upper, lower = envelope(subs2, _DTW_window(m, m, r))
 
-        # INSERT YOUR CODE
-        m = np.shape(subs1)[0]
-        r = int(r*m)
-
-        for i in range(m):
-          start = max(0, i - r)
-          stop = min(m, i + r + 1)
-          u = np.max(subs2[start:stop])
-          l = np.min(subs2[start:stop])
-          c = subs1[i]
-          #print(u,c,l)
-          if c > u:
-            lb_Keogh += (c - u)**2
-            #print(lb_Keogh)
-          elif c < l:
-            lb_Keogh += (c - l)**2
-            #print(lb_Keogh)
+        lb_Keogh = LB_Keogh(subs1, upper, lower)
 
         return lb_Keogh
 
 
+    def _prepare_scan(self):
+        """
+        Prepare the arrays scanned by _UCR_scan: the query (z-normalized if normalize
+        is True), its envelope and the order of its points, the values of time series
+        (series set is flattened row by row), their envelope and the statistics of subsequences.
+
+        Returns
+        -------
+        scan : dict
+            Arguments of _UCR_scan.
+        """
+
+        N, m = self.ts.shape
+        w = _DTW_window(m, m, self.r)
+
+        query = np.asarray(self.query, dtype=np.float64)
+        if self.normalize:
+            query = batch_z_normalize(query[np.newaxis])[0]
+        q_upper, q_lower = envelope(query, w)
+
+        if self.ts_values is None:
+            values = np.ascontiguousarray(self.ts, dtype=np.float64)
+            upper, lower = envelope(values, w)
+            values, upper, lower = values.ravel(), upper.ravel(), lower.ravel()
+            stride = m
+        else:
+            values = np.asarray(self.ts_values, dtype=np.float64)
+            upper, lower = envelope(values, w)
+            stride = 1
+
+        mu = np.asarray(self.ts_mean, dtype=np.float64)
+        sigma = np.asarray(self.ts_std, dtype=np.float64)
+        if not self.normalize:
+            mu = np.where(np.isfinite(mu), 0.0, np.inf)
+            sigma = np.ones(N)
+
+        return {'values': values, 'stride': stride, 'm': m, 'query': query,
+                'q_upper': q_upper, 'q_lower': q_lower,
+                # the points of the query far from the mean give the largest contributions
+                'order': np.argsort(-np.abs(query), kind='stable'),
+                'upper': upper, 'lower': lower, 'mu': mu, 'sigma': sigma, 'w': w}
+
+
+    def _scan_block(self, top_dist, top_idx, min_gap, index_offset=0):
+        """
+        Compute the distances between the query and all subsequences with the UCR suite
+        and update the top-k (the pruned subsequences get np.inf).
+
+        Parameters
+        ----------
+        top_dist : numpy.ndarrray
+            Distances of the current top-k matches in ascending order (updated inplace).
+
+        top_idx : numpy.ndarrray
+            Indices of the current top-k matches (updated inplace).
+
+        min_gap : int
+            Minimum gap between the top-k matches.
+
+        index_offset : int, default = 0
+            Index of the first subsequence in a longer time series.
+
+        Returns
+        -------
+        distances : numpy.ndarrray
+            DTW distances between the query and subsequences.
+        """
+
+        N, m = self.ts.shape
+        scan = self._prepare_scan()
+
+        distances = np.empty(N)
+        counters = np.zeros(4, dtype=np.int64)
+
+        _UCR_scan(scan['values'], scan['stride'], m, scan['query'], scan['q_upper'], scan['q_lower'],
+                  scan['order'], scan['upper'], scan['lower'], scan['mu'], scan['sigma'], scan['w'],
+                  0, N, top_dist, top_idx, min_gap, index_offset, np.full(1, np.inf), 0, distances, counters)
+
+        self.lb_Kim_num, self.lb_KeoghQC_num, self.lb_KeoghCQ_num, self.dtw_num = (int(n) for n in counters)
+
+        return distances
+
+
+    def _scan_parallel(self, n_jobs, min_gap):
+        """
+        Compute the distances between the query and all subsequences with the UCR suite
+        in a pool of worker processes.
+
+        The subsequences are split into segments (the values of neighbouring segments
+        overlap by m-1 points). Time series, its envelope and statistics are placed
+        in shared memory. Every segment publishes the k-th distance of its top-k into
+        a shared array, and every worker prunes with the least published one,
+        so a good match found by one worker speeds up the others.
+
+        Parameters
+        ----------
+        n_jobs : int
+            Number of worker processes.
+
+        min_gap : int
+            Minimum gap between the top-k matches.
+
+        Returns
+        -------
+        distances : numpy.ndarrray
+            DTW distances between the query and subsequences (np.inf for the pruned ones).
+        """
+
+        N, m = self.ts.shape
+        scan = self._prepare_scan()
+
+        # several segments per worker even out the unequal pruning
+        segments = split_range(N, 4*n_jobs)
+
+        arrays = {key: scan.pop(key) for key in ('values', 'upper', 'lower', 'mu', 'sigma')}
+        arrays['distances'] = np.full(N, np.inf)
+        arrays['shared_bsf'] = np.full(len(segments), np.inf)
+        params = dict(scan, top_k=self.top_k, min_gap=min_gap)
+
+        blocks, specs = share_arrays(arrays)
+        try:
+            with Pool(n_jobs, initializer=_init_scan_worker, initargs=(specs, params)) as pool:
+                results = pool.map(_scan_segment, [(slot, start, stop) for slot, (start, stop) in enumerate(segments)])
+            distances_shm = blocks[list(arrays).index('distances')]
+            distances = np.ndarray(N, dtype=np.float64, buffer=distances_shm.buf).copy()
+        finally:
+            release_shared_arrays(blocks)
+
+        # the counters of segments are summed per worker process
+        workers = {}
+        for pid, counters in results:
+            workers[pid] = workers.get(pid, 0) + counters
+        self.workers_counters = [dict(zip(('lb_Kim_num', 'lb_KeoghQC_num', 'lb_KeoghCQ_num', 'dtw_num'), (int(n) for n in counters)))
+                                 for counters in workers.values()]
+
+        total = np.sum(list(workers.values()), axis=0)
+        self.lb_Kim_num, self.lb_KeoghQC_num, self.lb_KeoghCQ_num, self.dtw_num = (int(n) for n in total)
+
+        return distances
+
+
     def perform(self):
         """
         Perform the best match finder using UCR-DTW algorithm.
+
+        The UCR suite optimizations are applied: z-normalization of the candidate
+        points on the fly with the precomputed sliding statistics, cascade of
+        LB_Kim, LB_Keogh with the query envelope and LB_Keogh with the candidate
+        envelope (each abandoned at best-so-far, visiting the query points in the
+        order of decreasing absolute z-value), and DTW abandoned with the
+        cumulative lower bound of the rest of the warping path.
+
+        If n_jobs is not 1, the subsequences are scanned by a pool of worker
+        processes sharing the best-so-far (see _scan_parallel), and the result
+        also contains the counters of each worker ('workers').
         
         Returns
         -------
@@ -272,57 +745,587 @@ class UCR_DTW(BestMatchFinder):
             excl_zone = 0
         else:
             excl_zone = int(np.ceil(m / self.excl_zone_denom))
-        
-        self.lb_Kim_num = 0
-        self.lb_KeoghQC_num = 0
-        self.lb_KeoghCQ_num = 0
-        
-        # INSERT YOUR CODE
 
-        dist_list = []
-        r = self.r*m
-        ts = copy.deepcopy(self.ts)
-        query = z_normalize(copy.deepcopy(self.query))
-        qery_len = len(self.query)
-        
-        
-        bsf = float("inf")
-        for i in range(0,N - qery_len,self.excl_zone_denom):
-          #bsf = float("inf")
-          C =  z_normalize(ts[i:i+qery_len][0])
-          
-          if self._LB_Keogh(query,C,  r) < bsf:
-            #print('_LB_Keogh2',self._LB_Keogh(query,C,  r), bsf)
-            
-            if self._LB_Keogh(C,query,  r) < bsf:
-              #print('_LB_Keogh1',self._LB_Keogh(C,query,  r), bsf)
-              
-              if self._LB_Kim(C, query) < bsf:
-                #print('_LB_Kim',self._LB_Kim(C, query), bsf)
-                dist = DTW_distance(query, C, self.r)
-                #print(dist)
-                if dist < bsf:
-                  bsf = dist
-              else: 
-                self.lb_Kim_num += 1
-                #print('_LB_Kime',self._LB_Kim(C, query), bsf)
-                dist = float("inf")
-            else: 
-              self.lb_KeoghQC_num += 1
-              #print('_LB_Keogh1e',self._LB_Keogh(C,query,  r), bsf)
-              dist = float("inf")
-          else: 
-            self.lb_KeoghCQ_num += 1
-            #print('_LB_Keogh2e',self._LB_Keogh(query,C,  r), bsf)
-            dist = float("inf")
-          dist_list.append(dist)
-        bsf = float("inf")
-        #print(dist_list)
-        self.bestmatch = self._top_k_match( dist_list, m, bsf, excl_zone)
+        # best-so-far is the k-th distance among the current matches which
+        # are too far from each other to be suppressed by exclusion zones
+        top_dist = np.full(self.top_k, np.inf)
+        top_idx = np.full(self.top_k, -1, dtype=np.int64)
+
+        n_jobs = os.cpu_count() if self.n_jobs in (None, -1) else self.n_jobs
+        if n_jobs == 1:
+            distances = self._scan_block(top_dist, top_idx, 2*excl_zone)
+            self.workers_counters = None
+        else:
+            distances = self._scan_parallel(n_jobs, 2*excl_zone)
+
+        self.bestmatch = self._top_k_match(distances, m, bsf, excl_zone)
+
+        best_match_results = {'index' : self.bestmatch['index'],
+                              'distance' : self.bestmatch['distance'],
+                              'lb_Kim_num': self.lb_Kim_num,
+                              'lb_KeoghCQ_num': self.lb_KeoghCQ_num,
+                              'lb_KeoghQC_num': self.lb_KeoghQC_num
+                              }
+        if self.workers_counters is not None:
+            best_match_results['workers'] = self.workers_counters
+
+        return best_match_results
+
+
+# the shared arrays and the query attached by the UCR-DTW scan pool worker
+_worker_state = {}
+
+
+def _init_scan_worker(specs, params):
+    """
+    Attach the shared time series arrays in a pool worker.
+    """
+
+    arrays, blocks = attach_shared_arrays(specs)
+    _worker_state.update(arrays=arrays, params=params, blocks=blocks)
+
+
+def _scan_segment(task):
+    """
+    Pool task: scan a segment of the shared subsequences with the UCR suite.
+
+    Parameters
+    ----------
+    task : tuple of int
+        (slot in the shared best-so-far array, segment start, segment stop).
+
+    Returns
+    -------
+    pid : int
+        Id of the worker process.
+
+    counters : numpy.ndarray
+        [lb_Kim_num, lb_KeoghQC_num, lb_KeoghCQ_num, dtw_num] of the segment.
+    """
+
+    slot, start, stop = task
+    arrays = _worker_state['arrays']
+    params = _worker_state['params']
+
+    top_dist = np.full(params['top_k'], np.inf)
+    top_idx = np.full(params['top_k'], -1, dtype=np.int64)
+    counters = np.zeros(4, dtype=np.int64)
+
+    _UCR_scan(arrays['values'], params['stride'], params['m'], params['query'], params['q_upper'], params['q_lower'],
+              params['order'], arrays['upper'], arrays['lower'], arrays['mu'], arrays['sigma'], params['w'],
+              start, stop, top_dist, top_idx, params['min_gap'], 0, arrays['shared_bsf'], slot,
+              arrays['distances'], counters)
+
+    return os.getpid(), counters
+
+
+class MASSBestMatchFinder(BestMatchFinder):
+    """
+    MASS (Mueen's Algorithm for Similarity Search) Best Match Finder.
+
+    The Euclidean distances (z-normalized if normalize is True) between the query
+    and all subsequences are computed at once from the FFT-based sliding dot product
+    and the sliding means and standard deviations of time series. The FFT of
+    time series and the statistics are cached, so repeated queries cost
+    one FFT of the query and one inverse FFT.
+    """
+
+    def __init__(self, ts=None, query=None, exclusion_zone=1, top_k=3, normalize=True, r=0.05):
+        super().__init__(ts, query, exclusion_zone, top_k, normalize, r)
+
+        self._stats = {len(self.query): (self.ts_mean, self.ts_std)}
+        self._ts_fft = None
+
+
+    def _dot_products(self, query):
+        """
+        Compute the dot products of the query and all subsequences.
+        """
+
+        if self.ts_values is None:
+            return self.ts @ query
+
+        if self._ts_fft is None:
+            self._ts_fft = series_fft(self.ts_values)
+
+        return sliding_dot_product(query, self._ts_fft, self.ts_values.shape[0])
+
+
+    def _subsequence_stats(self, m):
+        """
+        Get the means and standard deviations of all subsequences of length m.
+        """
+
+        if self.ts_values is None:
+            return self.ts_mean, self.ts_std
+
+        if m not in self._stats:
+            self._stats[m] = sliding_stats(self.ts_values, m)
+
+        return self._stats[m]
 
-        return {'index' : self.bestmatch['index'],
-                'distance' : self.bestmatch['distance'],
-                'lb_Kim_num': self.lb_Kim_num,
-                'lb_KeoghCQ_num': self.lb_KeoghCQ_num,
-                'lb_KeoghQC_num': self.lb_KeoghQC_num
-                }
+
+    def _distance_profile(self, query, QT, mu, sigma):
+        """
+        Compute the distances between the query and all subsequences
+        from their dot products and statistics.
+
+        Parameters
+        ----------
+        query : numpy.ndarrray
+            Query.
+
+        QT : numpy.ndarrray
+            Dot products of the query and subsequences.
+
+        mu : numpy.ndarrray
+            Means of subsequences.
+
+        sigma : numpy.ndarrray
+            Standard deviations of subsequences.
+
+        Returns
+        -------
+        distances : numpy.ndarrray
+            Distances between the query and subsequences
+            (np.inf for subsequences with non-finite values).
+        """
+
+        m = len(query)
+        mu_q = np.mean(query)
+        sigma_q = np.std(query)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.normalize:
+                corr = (QT - m*mu_q*mu) / (m*sigma_q*sigma)
+                sq_dist = 2*m*(1 - corr)
+                # a constant subsequence is at distance sqrt(m) from any non-constant one
+                constant = (sigma == 0)
+                sq_dist[constant] = 0 if sigma_q == 0 else m
+                if sigma_q == 0:
+                    sq_dist[~constant] = m
+            else:
+                sq_dist = np.sum(query ** 2) - 2*QT + m*(sigma ** 2 + mu ** 2)
+
+        sq_dist[~np.isfinite(mu)] = np.inf
+
+        return np.sqrt(np.maximum(sq_dist, 0))
+
+
+    def _scan_block(self, top_dist, top_idx, min_gap, index_offset=0):
+        """
+        Compute the distances between the query and all subsequences and update the top-k.
+
+        Parameters
+        ----------
+        top_dist : numpy.ndarrray
+            Distances of the current top-k matches in ascending order (updated inplace).
+
+        top_idx : numpy.ndarrray
+            Indices of the current top-k matches (updated inplace).
+
+        min_gap : int
+            Minimum gap between the top-k matches.
+
+        index_offset : int, default = 0
+            Index of the first subsequence in a longer time series.
+
+        Returns
+        -------
+        distances : numpy.ndarrray
+            Distances between the query and subsequences.
+        """
+
+        query = np.asarray(self.query, dtype=np.float64)
+        mu, sigma = self._subsequence_stats(len(query))
+        distances = self._distance_profile(query, self._dot_products(query), mu, sigma)
+
+        _merge_top_k(top_dist, top_idx, distances, index_offset, min_gap)
+
+        return distances
+
+
+    def perform(self, query=None):
+        """
+        Perform the best match finder using MASS algorithm.
+
+        Parameters
+        ----------
+        query : numpy.ndarrray, default = None
+            New query (of any length if ts is time series). If None, the query
+            given at the construction is used.
+
+        Returns
+        -------
+        best_match_results: dict
+            Dictionary containing results of MASS algorithm.
+        """
+
+        if query is not None:
+            self.query = np.array(query)
+
+        query = np.asarray(self.query, dtype=np.float64)
+        m = len(query)
+
+        if (self.excl_zone_denom is None):
+            excl_zone = 0
+        else:
+            excl_zone = int(np.ceil(m / self.excl_zone_denom))
+
+        mu, sigma = self._subsequence_stats(m)
+        distances = self._distance_profile(query, self._dot_products(query), mu, sigma)
+
+        self.bestmatch = self._top_k_match(distances, m, float("inf"), excl_zone)
+
+        return self.bestmatch
+
+
+def _top_k_candidates(idx, dist, top_k, excl_zone):
+    """
+    Select the top-k matches from the kept subsequences like
+    BestMatchFinder._top_k_match does from the whole distance profile.
+
+    Parameters
+    ----------
+    idx : numpy.ndarrray
+        Indices of the kept subsequences.
+
+    dist : numpy.ndarrray
+        Distances of the kept subsequences.
+
+    top_k : int
+        Count of the best match subsequences.
+
+    excl_zone : int
+        Size of the exclusion zone.
+
+    Returns
+    -------
+    best_match_results: dict
+        Dictionary containing indices and distances of the top-k matches.
+    """
+
+    top, top_k_match_dist = top_k_with_exclusion(dist, top_k, excl_zone, positions=idx)
+    top_k_match_idx = list(idx[top])
+    top_k_match_dist = list(top_k_match_dist)
+
+    return {'index': top_k_match_idx, 'distance': top_k_match_dist}
+
+
+def _keep_candidates(kept_idx, kept_dist, distances, index_offset, bsf):
+    """
+    Keep only the subsequences which are not farther than the best-so-far
+    (the others can not get into the top-k).
+
+    Parameters
+    ----------
+    kept_idx : numpy.ndarrray
+        Indices of the subsequences kept so far.
+
+    kept_dist : numpy.ndarrray
+        Distances of the subsequences kept so far.
+
+    distances : numpy.ndarrray
+        Distances of the next scanned subsequences.
+
+    index_offset : int
+        Index of the first scanned subsequence.
+
+    bsf : float
+        Best-so-far.
+
+    Returns
+    -------
+    kept_idx : numpy.ndarrray
+        Indices of the kept subsequences.
+
+    kept_dist : numpy.ndarrray
+        Distances of the kept subsequences.
+    """
+
+    still_kept = kept_dist <= bsf
+    keep = np.isfinite(distances) & (distances <= bsf)
+
+    kept_idx = np.concatenate((kept_idx[still_kept], np.flatnonzero(keep) + index_offset))
+    kept_dist = np.concatenate((kept_dist[still_kept], distances[keep]))
+
+    return kept_idx, kept_dist
+
+
+class ChunkedBestMatchFinder:
+    """
+    Out-of-core Best Match Finder.
+
+    Time series (e.g. numpy.memmap returned by loaders.load_dataset or numpy.load
+    with mmap_mode='r') is read in chunks of chunk_size subsequences overlapped by m-1
+    points, so no subsequence is lost at the chunk boundaries. Each chunk is searched by
+    the finder, and the top-k (and so the best-so-far) is carried over to the next chunk.
+    Only the subsequences closer than the best-so-far are kept until the end, when the
+    top-k matches are selected from them with the exclusion zones. So the memory is
+    bounded by the chunk size rather than by the length of time series.
+
+    Parameters
+    ----------
+    ts : numpy.ndarrray
+        Time series.
+
+    query : numpy.ndarrray
+        Query.
+
+    finder : class, default = UCR_DTW
+        Best match finder searching a chunk: UCR_DTW or MASSBestMatchFinder.
+
+    chunk_size : int, default = 1000000
+        Number of subsequences in a chunk.
+
+    exclusion_zone : float, default = 1
+        The exclusion zone.
+
+    top_k : int, default = 3
+        Count of the best match subsequences.
+
+    normalize : bool, default = True
+        Z-normalize or not subsequences before computing distances.
+
+    r : float, default = 0.05
+        Warping window size.
+    """
+
+    def __init__(self, ts, query, finder=UCR_DTW, chunk_size=1_000_000, exclusion_zone=1, top_k=3, normalize=True, r=0.05):
+
+        self.ts = ts
+        self.query = np.array(query)
+        self.finder = finder
+        self.chunk_size = chunk_size
+        self.excl_zone_denom = exclusion_zone
+        self.top_k = top_k
+        self.normalize = normalize
+        self.r = r
+
+
+    def _chunks(self):
+        """
+        Read time series chunk by chunk.
+
+        Returns
+        -------
+        chunks : generator of tuples (int, numpy.ndarrray)
+            Index of the first subsequence of chunk and the chunk values.
+        """
+
+        m = len(self.query)
+        N = len(self.ts) - m + 1
+
+        for start in range(0, N, self.chunk_size):
+            yield start, np.asarray(self.ts[start:start+self.chunk_size+m-1], dtype=np.float64)
+
+
+    def perform(self):
+        """
+        Perform the best match finder chunk by chunk.
+
+        Returns
+        -------
+        best_match_results: dict
+            Dictionary containing results of the algorithm (and the lower bound
+            counters summed over chunks for UCR_DTW).
+        """
+
+        m = len(self.query)
+
+        if (self.excl_zone_denom is None):
+            excl_zone = 0
+        else:
+            excl_zone = int(np.ceil(m / self.excl_zone_denom))
+
+        top_dist = np.full(self.top_k, np.inf)
+        top_idx = np.full(self.top_k, -1, dtype=np.int64)
+
+        kept_idx = np.empty(0, dtype=np.int64)
+        kept_dist = np.empty(0)
+        counters = {}
+
+        for start, chunk in self._chunks():
+            finder = self.finder(chunk, self.query, self.excl_zone_denom, self.top_k, self.normalize, self.r)
+            distances = finder._scan_block(top_dist, top_idx, 2*excl_zone, start)
+
+            for key in ('lb_Kim_num', 'lb_KeoghCQ_num', 'lb_KeoghQC_num'):
+                if hasattr(finder, key):
+                    counters[key] = counters.get(key, 0) + getattr(finder, key)
+
+            kept_idx, kept_dist = _keep_candidates(kept_idx, kept_dist, distances, start, top_dist[-1])
+
+        self.bestmatch = _top_k_candidates(kept_idx, kept_dist, self.top_k, excl_zone)
+
+        return {**self.bestmatch, **counters}
+
+
+class MultiQueryBestMatchFinder:
+    """
+    UCR-DTW Best Match Finder for a set of queries (possibly of different lengths).
+
+    The sliding statistics of time series are computed once per query length and
+    its warping envelope once per warping window. Time series is scanned in one pass
+    (block by block): at each position the UCR suite lower bounds of all queries are
+    evaluated, and every query keeps its own top-k and best-so-far. Only the
+    subsequences closer than the best-so-far of a query are kept until the end,
+    when its top-k matches are selected with the exclusion zones.
+
+    Parameters
+    ----------
+    ts : numpy.ndarrray
+        Time series.
+
+    queries : list of numpy.ndarrray
+        Queries.
+
+    exclusion_zone : float, default = 1
+        The exclusion zone.
+
+    top_k : int, default = 3
+        Count of the best match subsequences of each query.
+
+    normalize : bool, default = True
+        Z-normalize or not subsequences before computing distances.
+
+    r : float, default = 0.05
+        Warping window size.
+
+    block_size : int, default = 65536
+        Number of positions scanned between the selections of the kept subsequences.
+    """
+
+    def __init__(self, ts, queries, exclusion_zone=1, top_k=3, normalize=True, r=0.05, block_size=65536):
+
+        self.ts_values = np.asarray(ts)
+        self.queries = [np.asarray(query, dtype=np.float64) for query in queries]
+        if any(len(query) > len(self.ts_values) for query in self.queries):
+            raise ValueError("The queries must not be longer than time series")
+
+        self.excl_zone_denom = exclusion_zone
+        self.top_k = top_k
+        self.normalize = normalize
+        self.r = r
+        self.block_size = block_size
+
+        self._stats = {}
+        self._envelopes = {}
+
+
+    def _subsequence_stats(self, m):
+        """
+        Get the means and standard deviations of all subsequences of length m
+        (computed once per length; np.inf and np.nan beyond the last subsequence).
+        """
+
+        if m not in self._stats:
+            n = len(self.ts_values)
+            mu = np.full(n, np.inf)
+            sigma = np.full(n, np.nan)
+            mu[:n-m+1], sigma[:n-m+1] = sliding_stats(self.ts_values, m)
+            if not self.normalize:
+                mu[np.isfinite(mu)] = 0.0
+                sigma[:] = 1.0
+            self._stats[m] = (mu, sigma)
+
+        return self._stats[m]
+
+
+    def _series_envelope(self, w):
+        """
+        Get the warping envelope of time series (computed once per window).
+        """
+
+        if w not in self._envelopes:
+            self._envelopes[w] = envelope(self.ts_values, w)
+
+        return self._envelopes[w]
+
+
+    def _prepare_scan(self):
+        """
+        Prepare the arguments of _multi_UCR_scan.
+
+        Returns
+        -------
+        scan : dict
+            The padded queries with their envelopes and orders, and the shared
+            statistics and envelopes of time series with the group of each query.
+        """
+
+        Q = len(self.queries)
+        lengths = np.array([len(query) for query in self.queries], dtype=np.int64)
+        max_m = lengths.max()
+        ws = np.array([_DTW_window(m, m, self.r) for m in lengths], dtype=np.int64)
+
+        queries = np.zeros((Q, max_m))
+        q_uppers = np.zeros((Q, max_m))
+        q_lowers = np.zeros((Q, max_m))
+        orders = np.zeros((Q, max_m), dtype=np.int64)
+        for q, query in enumerate(self.queries):
+            m = lengths[q]
+            if self.normalize:
+                query = batch_z_normalize(query[np.newaxis])[0]
+            queries[q, :m] = query
+            q_uppers[q, :m], q_lowers[q, :m] = envelope(query, ws[q])
+            orders[q, :m] = np.argsort(-np.abs(query), kind='stable')
+
+        stats_lengths = sorted(set(lengths.tolist()))
+        env_ws = sorted(set(ws.tolist()))
+
+        return {'values': np.asarray(self.ts_values, dtype=np.float64),
+                'uppers': np.stack([self._series_envelope(w)[0] for w in env_ws]),
+                'lowers': np.stack([self._series_envelope(w)[1] for w in env_ws]),
+                'env_group': np.array([env_ws.index(w) for w in ws], dtype=np.int64),
+                'mus': np.stack([self._subsequence_stats(m)[0] for m in stats_lengths]),
+                'sigmas': np.stack([self._subsequence_stats(m)[1] for m in stats_lengths]),
+                'stats_group': np.array([stats_lengths.index(m) for m in lengths], dtype=np.int64),
+                'queries': queries, 'lengths': lengths, 'q_uppers': q_uppers, 'q_lowers': q_lowers,
+                'orders': orders, 'ws': ws}
+
+
+    def perform(self):
+        """
+        Perform the best match finder for all queries in one pass over time series.
+
+        Returns
+        -------
+        best_match_results: list of dict
+            Dictionary containing results of UCR-DTW algorithm for each query.
+        """
+
+        Q = len(self.queries)
+        lengths = np.array([len(query) for query in self.queries], dtype=np.int64)
+
+        if (self.excl_zone_denom is None):
+            excl_zones = np.zeros(Q, dtype=np.int64)
+        else:
+            excl_zones = np.ceil(lengths / self.excl_zone_denom).astype(np.int64)
+
+        scan = self._prepare_scan()
+
+        top_dist = np.full((Q, self.top_k), np.inf)
+        top_idx = np.full((Q, self.top_k), -1, dtype=np.int64)
+        counters = np.zeros((Q, 4), dtype=np.int64)
+        distances = np.empty((Q, min(self.block_size, len(self.ts_values))))
+
+        kept = [(np.empty(0, dtype=np.int64), np.empty(0)) for _ in range(Q)]
+
+        N = len(self.ts_values) - lengths.min() + 1
+        for start in range(0, N, self.block_size):
+            stop = min(start + self.block_size, N)
+            _multi_UCR_scan(scan['values'], scan['uppers'], scan['lowers'], scan['env_group'],
+                            scan['mus'], scan['sigmas'], scan['stats_group'], scan['queries'], scan['lengths'],
+                            scan['q_uppers'], scan['q_lowers'], scan['orders'], scan['ws'],
+                            start, stop, top_dist, top_idx, 2*excl_zones, distances, counters)
+
+            for q in range(Q):
+                kept[q] = _keep_candidates(*kept[q], distances[q, :stop-start], start, top_dist[q, -1])
+
+        self.bestmatch = []
+        for q in range(Q):
+            best_match = _top_k_candidates(*kept[q], self.top_k, excl_zones[q])
+            best_match.update(zip(('lb_Kim_num', 'lb_KeoghQC_num', 'lb_KeoghCQ_num', 'dtw_num'), (int(n) for n in counters[q])))
+            self.bestmatch.append(best_match)
+
+        return self.bestmatch
@@ -1,14 +1,58 @@
 import numpy as np
 
 from modules.metrics import *
-from modules.utils import z_normalize
+from modules.metrics import _DTW_window
+from modules.utils import z_normalize, batch_z_normalize, envelope
 from modules.bestmatch import *
+from modules.vptree import VPTree
+from modules.parallel import share_arrays, attach_shared_arrays, release_shared_arrays, split_range
+
+import os
+import time
+from multiprocessing import Pool
 
 
 default_metrics_params = {'euclidean': {'normalize': True},
                          'dtw': {'normalize': True, 'r': 0.05, 'use_lb': True}
                          }
 
+def _append_rows(buffer, size, rows):
+    """
+    Write the rows after the first size rows of the buffer,
+    doubling the buffer capacity when it is full.
+
+    Parameters
+    ----------
+    buffer : numpy.ndarray
+        The buffer.
+
+    size : int
+        Number of the used rows of the buffer.
+
+    rows : numpy.ndarray
+        The rows to append.
+
+    Returns
+    -------
+    buffer : numpy.ndarray
+        The buffer holding size + len(rows) used rows (a new array if it has grown).
+    """
+
+    new_size = size + len(rows)
+    dtype = np.result_type(buffer.dtype, rows.dtype)
+
+    if (new_size > buffer.shape[0]) or (dtype != buffer.dtype) or (not buffer.flags.writeable) \
+            or (not buffer.flags.owndata):
+        capacity = max(new_size, 2*size, 16)
+        grown = np.empty((capacity,) + buffer.shape[1:], dtype=dtype)
+        grown[:size] = buffer[:size]
+        buffer = grown
+
+    buffer[size:new_size] = rows
+
+    return buffer
+
+
 class TimeSeriesKNN:
     """
     KNN Time Series Classifier.
@@ -24,15 +68,74 @@ class TimeSeriesKNN:
 
     metric_params : dict, default = None
         Dictionary containing parameters for the distance metric being used.
+
+    block_size : int, default = 1024
+        Number of test samples whose distances to the train set are computed
+        at once by the batched euclidean prediction (bounds the memory usage).
+
+    n_jobs : int, default = 1
+        Number of worker processes used by predict. If None or -1, the number of CPUs is used.
+        The workers are kept between predict calls until close is called (or the model
+        used as a context manager exits).
+
+    algorithm : str, default = 'brute'
+        Search algorithm for the euclidean metric.
+        Options: {brute, vptree}.
     """
     
-    def __init__(self, n_neighbors=3, metric='euclidean', metric_params=None):
+    def __init__(self, n_neighbors=3, metric='euclidean', metric_params=None, block_size=1024, n_jobs=1,
+                 algorithm='brute'):
 
         self.n_neighbors = n_neighbors
         self.metric = metric
         self.metric_params = default_metrics_params[metric].copy()
         if metric_params is not None:
             self.metric_params.update(metric_params)
+        self.block_size = block_size
+        self.n_jobs = n_jobs
+
+        if algorithm not in ('brute', 'vptree'):
+            raise ValueError(f"Unknown algorithm '{algorithm}'. Options: brute, vptree")
+        if (algorithm == 'vptree') and (metric != 'euclidean'):
+            raise ValueError("The vptree algorithm supports only the euclidean metric")
+        self.algorithm = algorithm
+
+        # the prediction pool and the shared train state, kept between predict calls
+        self._pool = None
+        self._pool_blocks = []
+        self._pool_state = None
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+
+    def __del__(self):
+
+        self.close()
+
+
+    def close(self):
+        """
+        Stop the prediction pool and release the shared memory of the train state.
+        """
+
+        if getattr(self, '_pool', None) is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        if getattr(self, '_pool_blocks', None):
+            release_shared_arrays(self._pool_blocks)
+            self._pool_blocks = []
+
+        self._pool_state = None
 
 
     def fit(self, X_train, Y_train):
@@ -41,15 +144,160 @@ class TimeSeriesKNN:
 
         Parameters
         ----------
-        X_train : numpy.ndarrray (2d array of shape (ts_number, ts_length))
-            The train set.
+        X_train : numpy.ndarrray or pandas.DataFrame (2d array of shape (ts_number, ts_length))
+            The train set (a sliding window view is used as is, without copying).
         
         Y_train : numpy.ndarrray
             Labels of the train set.
         """
        
-        self.X_train = X_train.to_numpy()
-        self.Y_train = Y_train.to_numpy()
+        # the workers of the prediction pool hold the previous train state
+        self.close()
+
+        self.X_train = np.asarray(X_train)
+        self.Y_train = np.asarray(Y_train)
+
+        # labels are voted by their codes
+        self.classes_, self._Y_train_codes = np.unique(self.Y_train, return_inverse=True)
+
+        # append-only storage is allocated by the first partial_fit
+        self._buffers = None
+        self._index_buffers = None
+
+        self._index = None
+        self._build_index()
+
+        return self
+
+
+    def _index_rows(self, X):
+        """
+        Compute the train index entries of the train samples.
+
+        Parameters
+        ----------
+        X : numpy.ndarray (2d array of shape (ts_number, ts_length))
+            Train samples.
+
+        Returns
+        -------
+        rows : dict
+            The (z-normalized) samples and, for the DTW metric, their warping envelopes
+            and LB_Kim features.
+        """
+
+        if self.metric_params['normalize']:
+            X = batch_z_normalize(X)
+        else:
+            X = np.asarray(X, dtype=np.float64)
+
+        rows = {'X': X}
+
+        if self.metric == 'dtw':
+            rows['upper'], rows['lower'] = envelope(X, self._index['w'])
+            rows['kim_features'] = Kim_features(X)
+
+        return rows
+
+
+    def _build_index(self):
+        """
+        Build the train index: the (z-normalized) train samples and, for the DTW metric,
+        their warping envelopes and LB_Kim features.
+        """
+
+        r = self.metric_params.get('r')
+        m = self.X_train.shape[1]
+
+        self._index = {'normalize': self.metric_params['normalize'], 'r': r}
+        if self.metric == 'dtw':
+            self._index['w'] = _DTW_window(m, m, r)
+
+        self._index_buffers = self._index_rows(self.X_train)
+        self._index.update(self._index_buffers)
+
+
+    def partial_fit(self, X_train, Y_train):
+        """
+        Append new samples to the training data.
+
+        The samples are stored in preallocated buffers whose capacity doubles when
+        they are full, and only the train index entries of the new samples are computed.
+        The model can be used for prediction between the calls.
+
+        Parameters
+        ----------
+        X_train : numpy.ndarrray or pandas.DataFrame (2d array of shape (ts_number, ts_length))
+            New samples of the train set.
+        
+        Y_train : numpy.ndarrray
+            Labels of the new samples.
+
+        Returns
+        -------
+        self: object
+            The updated model.
+        """
+
+        X_new = np.asarray(X_train, dtype=np.float64)
+        Y_new = np.asarray(Y_train)
+
+        if not hasattr(self, 'X_train'):
+            return self.fit(X_new.copy(), Y_new.copy())
+
+        self.close()
+
+        size = self.X_train.shape[0]
+
+        if self._buffers is None:
+            self._buffers = {'X': self.X_train, 'Y': self.Y_train, 'codes': self._Y_train_codes}
+
+        # a new class shifts the codes of the following classes
+        classes = np.union1d(self.classes_, Y_new)
+        if len(classes) != len(self.classes_):
+            self._buffers['codes'][:size] = np.searchsorted(classes, self.classes_[self._Y_train_codes])
+            self.classes_ = classes
+
+        self._buffers['X'] = _append_rows(self._buffers['X'], size, X_new)
+        self._buffers['Y'] = _append_rows(self._buffers['Y'], size, Y_new)
+        self._buffers['codes'] = _append_rows(self._buffers['codes'], size, np.searchsorted(self.classes_, Y_new))
+
+        new_size = size + X_new.shape[0]
+        self.X_train = self._buffers['X'][:new_size]
+        self.Y_train = self._buffers['Y'][:new_size]
+        self._Y_train_codes = self._buffers['codes'][:new_size]
+
+        # an outdated index is rebuilt from scratch by the next prediction
+        if (self._index is not None) and (self._index['normalize'] == self.metric_params['normalize']) \
+                and (self._index['r'] == self.metric_params.get('r')):
+            for key, rows in self._index_rows(X_new).items():
+                self._index_buffers[key] = _append_rows(self._index_buffers[key], size, rows)
+                self._index[key] = self._index_buffers[key][:new_size]
+            self._index['tree'] = None
+        else:
+            self._index = None
+
+        return self
+
+
+    def _get_index(self):
+        """
+        Get the train index, rebuilding it if normalize or r have been changed since it was built.
+
+        Returns
+        -------
+        index : dict
+            The train index.
+        """
+
+        if (self._index is None) or (self._index['normalize'] != self.metric_params['normalize']) \
+                or (self._index['r'] != self.metric_params.get('r')):
+            self._build_index()
+
+        if (self.metric == 'euclidean') and (self.algorithm == 'vptree') and (self._index.get('tree') is None):
+            self._index['tree'] = VPTree(self._index['X'], normalize=False)
+
+        return self._index
 
 
     def _distance(self, x_train, x_test):
@@ -72,7 +320,17 @@ class TimeSeriesKNN:
 
         dist = 0
 
-        # INSERT YOUR CODE
+        if self.metric == 'euclidean':
+            if self.metric_params['normalize']:
+                dist = norm_ED_distance(x_train, x_test)
+            else:
+                dist = ED_distance(x_train, x_test)
+        elif self.metric == 'dtw':
+            if self.metric_params['normalize']:
+                x_train, x_test = z_normalize(x_train), z_normalize(x_test)
+            dist = DTW_distance(x_train, x_test, self.metric_params['r'])
+        else:
+            raise ValueError(f"Unknown metric '{self.metric}'. Options: euclidean, dtw")
 
         return dist
 
@@ -94,15 +352,297 @@ class TimeSeriesKNN:
 
         neighbors = []
 
-        # INSERT YOUR CODE
+        distances = np.array([self._distance(x_train, x_test) for x_train in self.X_train])
+        neighbors_idx = np.argsort(distances, kind='stable')[:self.n_neighbors]
+
+        neighbors = [(distances[idx], self.Y_train[idx]) for idx in neighbors_idx]
 
         return neighbors
 
 
+    def _vote(self, neighbors_idx):
+        """
+        Choose the most frequent label among the neighbors of each test sample
+        (ties are resolved in favor of the smallest label).
+
+        Parameters
+        ----------
+        neighbors_idx : numpy.ndarray (2d array of shape (test_number, n_neighbors))
+            Indices of the neighbors in the train set.
+
+        Returns
+        -------
+        y_pred : numpy.ndarray
+            Class labels for test samples.
+        """
+
+        codes = self._Y_train_codes[neighbors_idx]
+        counts = np.zeros((codes.shape[0], len(self.classes_)), dtype=np.int64)
+        np.add.at(counts, (np.arange(codes.shape[0])[:, np.newaxis], codes), 1)
+
+        return self.classes_[np.argmax(counts, axis=1)]
+
+
+    def _predict_euclidean(self, X_test):
+        """
+        Predict the class labels for all test samples at once using the euclidean metric.
+
+        The test-by-train distance matrix is computed block by block with matrix products.
+        With the vptree algorithm, the neighbors are searched in the vantage-point tree instead
+        and the numbers of visited train samples are stored in the tree_counters attribute.
+
+        Parameters
+        ----------
+        X_test : numpy.ndarray (2d array of shape (ts_number, ts_length))
+            The test set.
+
+        Returns
+        -------
+        y_pred : numpy.ndarray
+            Class labels for each data sample from test set.
+        """
+
+        k = min(self.n_neighbors, self.X_train.shape[0])
+        normalize = self.metric_params['normalize']
+
+        index = self._get_index()
+        X_train = index['X']
+
+        if self.algorithm == 'vptree':
+            X_test = batch_z_normalize(X_test) if normalize else np.asarray(X_test, dtype=np.float64)
+            neighbors_idx = np.zeros((X_test.shape[0], k), dtype=np.int64)
+            self.tree_counters = {'visited_num': np.zeros(X_test.shape[0], dtype=np.int64)}
+            for i, x_test in enumerate(X_test):
+                _, neighbors_idx[i] = index['tree'].query(x_test, k)
+                self.tree_counters['visited_num'][i] = index['tree'].visited_num
+            return self._vote(neighbors_idx)
+
+        y_pred = np.empty(X_test.shape[0], dtype=self.classes_.dtype)
+        for start in range(0, X_test.shape[0], self.block_size):
+            stop = min(start + self.block_size, X_test.shape[0])
+            X_block = batch_z_normalize(X_test[start:stop]) if normalize else X_test[start:stop]
+
+            distances = pairwise_distances(X_block, X_train, metric='euclidean', block_size=self.block_size)
+            neighbors_idx = np.argpartition(distances, k-1, axis=1)[:, :k]
+            y_pred[start:stop] = self._vote(neighbors_idx)
+
+        return y_pred
+
+
+    def _find_neighbors_lb(self, x_test, index, test_upper=None, test_lower=None):
+        """
+        Find the k nearest neighbors of the test sample by DTW using the lower bounds cascade
+        LB_Kim -> LB_Keogh(EQ) -> LB_Keogh(EC) and early abandoning DTW.
+
+        A candidate is pruned as soon as one of its lower bounds reaches the distance
+        to the current k-th nearest neighbor.
+
+        Parameters
+        ----------
+        x_test : numpy.ndarray
+            (Z-normalized) sample of the test set.
+
+        index : dict
+            The train index (see _build_index).
+
+        test_upper : numpy.ndarray, default = None
+            Precomputed upper warping envelope of the test sample.
+
+        test_lower : numpy.ndarray, default = None
+            Precomputed lower warping envelope of the test sample.
+
+        Returns
+        -------
+        neighbors_idx : numpy.ndarray
+            Indices of the k nearest neighbors in the train set.
+
+        counters : dict
+            Numbers of candidates pruned by each lower bound, computed DTW distances
+            and early abandoned DTW computations.
+        """
+
+        X_train, w = index['X'], index['w']
+        k = min(self.n_neighbors, X_train.shape[0])
+        r = index['r']
+
+        best_dist = np.full(k, np.inf)
+        best_idx = np.full(k, -1, dtype=np.int64)
+        kth_dist = np.inf
+
+        counters = {'lb_Kim_num': 0, 'lb_KeoghEQ_num': 0, 'lb_KeoghEC_num': 0, 'dtw_num': 0, 'abandoned_num': 0}
+
+        if test_upper is None or test_lower is None:
+            test_upper, test_lower = envelope(x_test, w)
+        lb_Kim = LB_Kim_by_features(index['kim_features'], Kim_features(x_test))
+        lb_KeoghEQ = LB_Keogh(X_train, test_upper, test_lower)
+
+        # the candidates with small lower bounds tighten the k-th distance faster
+        for idx in np.argsort(lb_KeoghEQ, kind='stable'):
+            if lb_Kim[idx] >= kth_dist:
+                counters['lb_Kim_num'] += 1
+                continue
+            if lb_KeoghEQ[idx] >= kth_dist:
+                counters['lb_KeoghEQ_num'] += 1
+                continue
+            if LB_Keogh(x_test, index['upper'][idx], index['lower'][idx]) >= kth_dist:
+                counters['lb_KeoghEC_num'] += 1
+                continue
+
+            counters['dtw_num'] += 1
+            dist = DTW_distance(x_test, X_train[idx], r, abandon_above=kth_dist)
+            if np.isinf(dist):
+                counters['abandoned_num'] += 1
+            elif dist < kth_dist:
+                worst = np.argmax(best_dist)
+                best_dist[worst] = dist
+                best_idx[worst] = idx
+                kth_dist = np.max(best_dist)
+
+        order = np.argsort(best_dist, kind='stable')
+
+        return best_idx[order], counters
+
+
+    def _predict_dtw_lb(self, X_test):
+        """
+        Predict the class labels for samples of the test set by DTW using the lower bounds.
+
+        Per-sample pruning counters are stored in the lb_counters attribute.
+
+        Parameters
+        ----------
+        X_test : numpy.ndarray (2d array of shape (ts_number, ts_length))
+            The test set.
+
+        Returns
+        -------
+        y_pred : numpy.ndarray
+            Class labels for each data sample from test set.
+        """
+
+        index = self._get_index()
+        if index['normalize']:
+            X_test = batch_z_normalize(X_test)
+        else:
+            X_test = np.asarray(X_test, dtype=np.float64)
+
+        # the envelopes of all test samples are computed at once
+        test_upper, test_lower = envelope(X_test, index['w'])
+
+        neighbors_idx = []
+        self.lb_counters = {}
+        for i, x_test in enumerate(X_test):
+            idx, counters = self._find_neighbors_lb(x_test, index, test_upper[i], test_lower[i])
+            neighbors_idx.append(idx)
+            for key, value in counters.items():
+                self.lb_counters.setdefault(key, np.zeros(X_test.shape[0], dtype=np.int64))[i] = value
+
+        return self._vote(np.array(neighbors_idx))
+
+
+    def _predict_serial(self, X_test):
+        """
+        Predict the class labels for samples of the test set in the current process.
+
+        Parameters
+        ----------
+        X_test : numpy.ndarray (2d array of shape (ts_number, ts_length))
+            The test set.
+
+        Returns
+        -------
+        y_pred : numpy.ndarray
+            Class labels for each data sample from test set.
+        """
+
+        if self.metric == 'euclidean':
+            return self._predict_euclidean(X_test)
+        if self.metric_params.get('use_lb', False):
+            return self._predict_dtw_lb(X_test)
+
+        y_pred = []
+
+        for x_test in X_test:
+            neighbors = self._find_neighbors(x_test)
+            codes = np.searchsorted(self.classes_, [label for _, label in neighbors])
+            counts = np.bincount(codes, minlength=len(self.classes_))
+            y_pred.append(self.classes_[np.argmax(counts)])
+
+        return np.array(y_pred)
+
+
+    def _shared_state(self):
+        """
+        Collect the fitted state needed by prediction workers.
+
+        Returns
+        -------
+        arrays : dict
+            The arrays to be placed in shared memory.
+
+        params : dict
+            The small objects to be sent to each worker once.
+        """
+
+        index = self._get_index()
+        arrays = {'X_train': self.X_train, 'Y_train_codes': self._Y_train_codes}
+        params = {'n_neighbors': self.n_neighbors, 'metric': self.metric,
+                  'metric_params': self.metric_params, 'block_size': self.block_size,
+                  'algorithm': self.algorithm, 'classes_': self.classes_, 'index': {}}
+        for key, value in index.items():
+            if isinstance(value, np.ndarray):
+                arrays['index_' + key] = value
+            else:
+                params['index'][key] = value
+
+        return arrays, params
+
+
+    def _get_pool(self, n_jobs):
+        """
+        Get the prediction pool whose workers hold the current train state.
+
+        The pool is (re)created only if there is no pool yet or the train index,
+        the parameters of the model or the number of workers have changed.
+
+        Parameters
+        ----------
+        n_jobs : int
+            Number of worker processes.
+
+        Returns
+        -------
+        pool : multiprocessing.Pool
+            The pool of prediction workers.
+        """
+
+        index = self._get_index()
+        state = (self.n_neighbors, self.metric, repr(self.metric_params), self.block_size, self.algorithm,
+                 n_jobs, sorted(index))
+
+        # the index dictionary is compared by identity, since it is rebuilt when outdated
+        if (self._pool is None) or (self._pool_state[0] is not index) or (self._pool_state[1] != state):
+            self.close()
+            arrays, params = self._shared_state()
+            self._pool_blocks, specs = share_arrays(arrays)
+            self._pool = Pool(n_jobs, initializer=_init_predict_worker, initargs=(specs, params))
+            self._pool_state = (index, state)
+
+        return self._pool
+
+
     def predict(self, X_test):
         """
         Predict the class labels for samples of the test set.
 
+        If n_jobs is not 1, the test set is split into chunks which are processed
+        by a pool of worker processes. The fitted train data and the test set are
+        placed in shared memory, so they are not copied to each task.
+
+        The pool and the shared train data are created by the first parallel call and
+        reused by the next ones while the model and its parameters are not changed
+        (fit and partial_fit release them, as does close). Only the test set is shared anew.
+
         Parameters
         ----------
         X_test : numpy.ndarray (2d array of shape (ts_number, ts_length))
@@ -110,17 +650,216 @@ class TimeSeriesKNN:
 
         Returns
         -------
-        y_pred : list
+        y_pred : numpy.ndarray
             Class labels for each data sample from test set.
         """
 
-        y_pred = []
+        X_test = np.asarray(X_test)
 
-        # INSERT YOUR CODE
+        n_jobs = os.cpu_count() if self.n_jobs in (None, -1) else self.n_jobs
+        if (n_jobs == 1) or (X_test.shape[0] < 2):
+            return self._predict_serial(X_test)
+
+        pool = self._get_pool(n_jobs)
+        blocks, specs = share_arrays({'X_test': X_test})
+
+        # several chunks per worker even out the unequal pruning of DTW samples
+        chunks = split_range(X_test.shape[0], 4*n_jobs)
+
+        try:
+            results = pool.map(_predict_chunk, [(bounds, specs) for bounds in chunks])
+        finally:
+            release_shared_arrays(blocks)
+
+        y_pred = np.concatenate([y for y, _, _ in results])
+        if results[0][1] is not None:
+            self.lb_counters = {key: np.concatenate([counters[key] for _, counters, _ in results])
+                                for key in results[0][1]}
+        if results[0][2] is not None:
+            self.tree_counters = {key: np.concatenate([counters[key] for _, _, counters in results])
+                                  for key in results[0][2]}
 
         return y_pred
 
 
+# the model attached by the prediction pool worker
+_worker_state = {}
+
+
+def _init_predict_worker(specs, params):
+    """
+    Rebuild the fitted classifier in a pool worker on top of the shared arrays.
+    """
+
+    arrays, blocks = attach_shared_arrays(specs)
+
+    model = TimeSeriesKNN(params['n_neighbors'], params['metric'], params['metric_params'], params['block_size'],
+                          algorithm=params['algorithm'])
+    model.X_train = arrays['X_train']
+    model.classes_ = params['classes_']
+    model._Y_train_codes = arrays['Y_train_codes']
+    model.Y_train = model.classes_[model._Y_train_codes]
+    model._index = dict(params['index'])
+    for key, value in arrays.items():
+        if key.startswith('index_'):
+            model._index[key[len('index_'):]] = value
+
+    _worker_state.update(model=model, blocks=blocks)
+
+
+def _predict_chunk(task):
+    """
+    Pool task: predict the class labels for a chunk of the shared test set.
+
+    Parameters
+    ----------
+    task : tuple
+        Start and stop of the chunk and the shared memory specs of the test set.
+
+    Returns
+    -------
+    y_pred : numpy.ndarray
+        Class labels for the chunk.
+
+    lb_counters : dict
+        Pruning counters of the chunk (None if the lower bounds are not used).
+
+    tree_counters : dict
+        Vantage-point tree counters of the chunk (None if the tree is not used).
+    """
+
+    (start, stop), specs = task
+    model = _worker_state['model']
+    model.lb_counters = None
+    model.tree_counters = None
+
+    arrays, blocks = attach_shared_arrays(specs)
+    try:
+        y_pred = model._predict_serial(arrays['X_test'][start:stop])
+    finally:
+        del arrays
+        for shm in blocks:
+            shm.close()
+
+    return y_pred, model.lb_counters, model.tree_counters
+
+
+def select_warping_window(X_train, Y_train, r_list, n_neighbors=1, normalize=True, X_val=None, Y_val=None):
+    """
+    Evaluate the DTW KNN classifier for all warping window sizes in one sweep.
+
+    The accuracy is estimated by leave-one-out on the train set or, if the validation
+    set is given, by holdout. The sizes are processed in descending order: a banded DTW
+    can only grow when the band narrows, so the DTW distances computed (and the
+    early abandoning thresholds reached) for a larger r are lower bounds for all smaller r.
+    Together with LB_Keogh for the current r, they prune most of the DTW computations.
+
+    Parameters
+    ----------
+    X_train : numpy.ndarray (2d array of shape (ts_number, ts_length))
+        The train set.
+
+    Y_train : numpy.ndarray
+        Labels of the train set.
+
+    r_list : numpy.ndarray
+        Warping window sizes.
+
+    n_neighbors : int, default = 1
+        Number of neighbors.
+
+    normalize : bool, default = True
+        Z-normalize or not time series.
+
+    X_val : numpy.ndarray (2d array of shape (ts_number, ts_length)), default = None
+        The validation set. If None, leave-one-out is used.
+
+    Y_val : numpy.ndarray, default = None
+        Labels of the validation set.
+
+    Returns
+    -------
+    results : dict
+        Warping window sizes (in the order of r_list), classification accuracy,
+        runtime (in seconds) and number of computed DTW distances for each size.
+    """
+
+    model = TimeSeriesKNN(n_neighbors, 'dtw', {'normalize': normalize}).fit(X_train, Y_train)
+    candidates = model._get_index()['X']
+
+    leave_one_out = X_val is None
+    if leave_one_out:
+        queries, Y_true = candidates, model.Y_train
+    else:
+        queries = batch_z_normalize(X_val) if normalize else np.asarray(X_val, dtype=np.float64)
+        Y_true = np.asarray(Y_val)
+
+    Nq, Nc = queries.shape[0], candidates.shape[0]
+    m = candidates.shape[1]
+    k = min(n_neighbors, Nc - 1 if leave_one_out else Nc)
+
+    # the largest known lower bounds of DTW for the current and all smaller r
+    lower_bound = np.zeros((Nq, Nc))
+
+    r_list = np.asarray(r_list, dtype=np.float64)
+    accuracy = np.zeros(len(r_list))
+    runtime = np.zeros(len(r_list))
+    dtw_num = np.zeros(len(r_list), dtype=np.int64)
+
+    for r_idx in np.argsort(-r_list, kind='stable'):
+        start_time = time.perf_counter()
+
+        r = r_list[r_idx]
+        w = _DTW_window(m, m, r)
+        cand_upper, cand_lower = envelope(candidates, w)
+        query_upper, query_lower = envelope(queries, w)
+
+        # DTW distances for the current r (nan is unknown)
+        exact = np.full((Nq, Nc), np.nan)
+        neighbors_idx = np.zeros((Nq, k), dtype=np.int64)
+
+        for i in range(Nq):
+            lb = np.maximum(lower_bound[i], LB_Keogh(queries[i], cand_upper, cand_lower))
+            lb = np.maximum(lb, LB_Keogh(candidates, query_upper[i], query_lower[i]))
+            if leave_one_out:
+                lb[i] = np.inf
+
+            best_dist = np.full(k, np.inf)
+            best_idx = np.full(k, -1, dtype=np.int64)
+            kth_dist = np.inf
+
+            for j in np.argsort(lb, kind='stable'):
+                if lb[j] >= kth_dist:
+                    break
+
+                dist = exact[i, j]
+                if np.isnan(dist):
+                    dist = DTW_distance(queries[i], candidates[j], r, abandon_above=kth_dist)
+                    dtw_num[r_idx] += 1
+                    if np.isinf(dist):
+                        # the distance exceeds the threshold for this and all smaller r
+                        lower_bound[i, j] = max(lower_bound[i, j], kth_dist)
+                        continue
+                    exact[i, j] = dist
+                    lower_bound[i, j] = dist
+                    if leave_one_out:
+                        exact[j, i] = dist
+                        lower_bound[j, i] = dist
+
+                if dist < kth_dist:
+                    worst = np.argmax(best_dist)
+                    best_dist[worst] = dist
+                    best_idx[worst] = j
+                    kth_dist = np.max(best_dist)
+
+            neighbors_idx[i] = best_idx[np.argsort(best_dist, kind='stable')]
+
+        accuracy[r_idx] = calculate_accuracy(Y_true, model._vote(neighbors_idx))
+        runtime[r_idx] = time.perf_counter() - start_time
+
+    return {'r': r_list, 'accuracy': accuracy, 'time': runtime, 'dtw_num': dtw_num}
+
+
 def calculate_accuracy(y_true, y_pred):
     """
     Calculate accuracy classification score.
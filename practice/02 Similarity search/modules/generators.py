@@ -0,0 +1,181 @@
+import numpy as np
+
+from modules.utils import _allocate, random_walk
+
+
+def noisy_periodic(n, period, amplitude=1.0, noise_std=0.1, seed=None, out=None, dtype=np.float64, chunk_size=1_000_000):
+    """
+    Generate the sine time series with Gaussian noise.
+
+    Parameters
+    ----------
+    n : int
+        The length of time series.
+
+    period : float
+        Period of the sine (in points).
+
+    amplitude : float, default = 1.0
+        Amplitude of the sine.
+
+    noise_std : float, default = 0.1
+        Standard deviation of the noise.
+
+    seed : int or numpy.random.Generator, default = None
+        Seed of the random generator.
+
+    out : numpy.ndarray or str, default = None
+        Array or path of .npy file to write the time series into.
+
+    dtype : numpy.dtype, default = numpy.float64
+        Type of the time series values.
+
+    chunk_size : int, default = 1000000
+        Number of points generated at once.
+
+    Returns
+    -------
+    periodic_ts : numpy.ndarray
+        The generated time series.
+    """
+
+    rng = np.random.default_rng(seed)
+    periodic_ts = _allocate(n, out, dtype)
+
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        t = np.arange(start, stop)
+        periodic_ts[start:stop] = amplitude*np.sin(2*np.pi*t/period) + rng.normal(0, noise_std, stop-start)
+
+    return periodic_ts
+
+
+def _plant_positions(n, m, count, rng):
+    """
+    Choose random non-overlapping positions of the planted subsequences.
+
+    Every position is taken from the first m+1 points of its own slot of length 3m,
+    so the planted subsequences are separated by at least m points.
+
+    Parameters
+    ----------
+    n : int
+        The length of time series.
+
+    m : int
+        Length of the planted subsequences.
+
+    count : int
+        Number of the planted subsequences.
+
+    rng : numpy.random.Generator
+        The random generator.
+
+    Returns
+    -------
+    positions : numpy.ndarray
+        Sorted start indices of the planted subsequences.
+    """
+
+    slots_num = n // (3*m)
+    if count > slots_num:
+        raise ValueError(f"Time series of length {n} can not hold {count} subsequences of length {m}")
+
+    slots = rng.choice(slots_num, size=count, replace=False)
+
+    return np.sort(slots*3*m + rng.integers(0, m + 1, size=count))
+
+
+def _plant(ts, idx, pattern):
+    """
+    Replace the subsequence of time series with the pattern scaled to the local
+    mean and standard deviation (in-place).
+    """
+
+    m = len(pattern)
+    subs = ts[idx:idx+m]
+    std = np.std(subs)
+    ts[idx:idx+m] = np.mean(subs) + (std if std > 0 else 1)*pattern
+
+
+def plant_motifs(ts, m, occurrences=3, noise_std=0.05, seed=None):
+    """
+    Plant a motif (several similar subsequences) into time series (in-place).
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series.
+
+    m : int
+        Length of the motif.
+
+    occurrences : int, default = 3
+        Number of the motif occurrences.
+
+    noise_std : float, default = 0.05
+        Standard deviation of the noise added to each occurrence.
+
+    seed : int or numpy.random.Generator, default = None
+        Seed of the random generator.
+
+    Returns
+    -------
+    ts : numpy.ndarray
+        Time series with the planted motif.
+
+    ground_truth : dict
+        Start indices of the motif occurrences and the motif pattern.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    pattern = np.cumsum(rng.normal(0, 1, m))
+    pattern = (pattern - np.mean(pattern)) / np.std(pattern)
+
+    positions = _plant_positions(len(ts), m, occurrences, rng)
+    for idx in positions:
+        _plant(ts, idx, pattern + rng.normal(0, noise_std, m))
+
+    return ts, {'indices': positions, 'pattern': pattern}
+
+
+def plant_discords(ts, m, count=1, seed=None):
+    """
+    Plant discords (anomalous subsequences) into time series (in-place).
+
+    Each discord is a high-frequency sine burst with its own frequency,
+    so it is dissimilar to the rest of time series and to other discords.
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series.
+
+    m : int
+        Length of the discords.
+
+    count : int, default = 1
+        Number of the discords.
+
+    seed : int or numpy.random.Generator, default = None
+        Seed of the random generator.
+
+    Returns
+    -------
+    ts : numpy.ndarray
+        Time series with the planted discords.
+
+    ground_truth : dict
+        Start indices of the discords.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    positions = _plant_positions(len(ts), m, count, rng)
+    t = np.arange(m)
+    for idx in positions:
+        cycles = rng.uniform(m/8, m/4)
+        _plant(ts, idx, np.sqrt(2)*np.sin(2*np.pi*cycles*t/m))
+
+    return ts, {'indices': positions}
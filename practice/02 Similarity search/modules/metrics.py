@@ -1,4 +1,7 @@
 import numpy as np
+from numba import njit
+
+from modules.utils import batch_z_normalize
 
 
 def ED_distance(ts1, ts2):
@@ -63,7 +66,180 @@ def norm_ED_distance(ts1, ts2):
     return norm_ed_dist
 
 
-def DTW_distance(ts1, ts2, r=None):
+def _squared_norms(X, normalize):
+    """
+    Prepare time series set and its squared row norms for the Gram-matrix identity.
+
+    Parameters
+    ----------
+    X : numpy.ndarray (2d array of shape (ts_number, ts_length))
+        Time series set.
+
+    normalize : bool
+        Z-normalize or not time series.
+
+    Returns
+    -------
+    X : numpy.ndarray
+        (Z-normalized) time series set (constant time series are turned into zeros).
+
+    sq_norms : numpy.ndarray
+        Squared Euclidean norms of the rows of X.
+    """
+
+    X = np.asarray(X, dtype=np.float64)
+    if normalize:
+        X = batch_z_normalize(X)
+    sq_norms = np.einsum('ij,ij->i', X, X)
+
+    return X, sq_norms
+
+
+def pairwise_distances(X, Y=None, metric='euclidean', block_size=512, out=None):
+    """
+    Calculate the distance matrix between two time series sets.
+
+    Distances are computed tile by tile through the Gram-matrix identity
+    ||x - y||^2 = ||x||^2 + ||y||^2 - 2<x, y>, so every tile is one matrix product.
+
+    Parameters
+    ----------
+    X : numpy.ndarray (2d array of shape (ts_number1, ts_length))
+        The first time series set.
+
+    Y : numpy.ndarray (2d array of shape (ts_number2, ts_length)), default = None
+        The second time series set. If None, the distances between time series of X
+        are computed and only the upper triangle of tiles is evaluated.
+
+    metric : str, default = 'euclidean'
+        Distance measure between time series.
+        Options: {euclidean, norm_euclidean}.
+
+    block_size : int, default = 512
+        Number of time series in a tile.
+
+    out : numpy.ndarray (2d array of shape (ts_number1, ts_number2)), default = None
+        Preallocated (or memory-mapped) array to write the distance matrix into.
+
+    Returns
+    -------
+    out : numpy.ndarray
+        The distance matrix.
+    """
+
+    if metric not in ('euclidean', 'norm_euclidean'):
+        raise ValueError(f"Unknown metric '{metric}'. Options: euclidean, norm_euclidean")
+
+    normalize = (metric == 'norm_euclidean')
+    symmetric = Y is None
+
+    X, X_sq_norms = _squared_norms(X, normalize)
+    if symmetric:
+        Y, Y_sq_norms = X, X_sq_norms
+    else:
+        Y, Y_sq_norms = _squared_norms(Y, normalize)
+
+    N1, N2 = X.shape[0], Y.shape[0]
+    if out is None:
+        out = np.empty((N1, N2), dtype=np.float64)
+    elif out.shape != (N1, N2):
+        raise ValueError(f"out must have shape {(N1, N2)}, got {out.shape}")
+
+    for i in range(0, N1, block_size):
+        i_stop = min(i + block_size, N1)
+        j_start = i if symmetric else 0
+        for j in range(j_start, N2, block_size):
+            j_stop = min(j + block_size, N2)
+
+            tile = X[i:i_stop] @ Y[j:j_stop].T
+            tile *= -2
+            tile += X_sq_norms[i:i_stop, np.newaxis]
+            tile += Y_sq_norms[np.newaxis, j:j_stop]
+            np.maximum(tile, 0, out=tile)
+            np.sqrt(tile, out=tile)
+
+            out[i:i_stop, j:j_stop] = tile
+            if symmetric and (j != i):
+                out[j:j_stop, i:i_stop] = tile.T
+
+    if symmetric:
+        np.fill_diagonal(out, 0)
+
+    return out
+
+
+def _DTW_window(n, m, r):
+    """
+    Convert the warping window size into the Sakoe-Chiba band half-width.
+
+    Parameters
+    ----------
+    n : int
+        Length of the first time series.
+
+    m : int
+        Length of the second time series.
+
+    r : float
+        Warping window size (fraction of the time series length).
+
+    Returns
+    -------
+    w : int
+        Band half-width (in points).
+    """
+
+    if r is None:
+        return max(n, m)
+
+    w = int(np.floor(r*max(n, m)))
+
+    # the end cell (n, m) must stay reachable
+    return max(w, abs(n - m))
+
+
+@njit(cache=True)
+def _DTW_band(ts1, ts2, w, abandon_above):
+    """
+    Compute DTW distance inside the Sakoe-Chiba band keeping only two band rows.
+
+    Cell D[i, j] of the row i is stored at position j - i + w + 1 of a row buffer,
+    so the buffers have 2w+3 elements regardless of the time series length.
+    """
+
+    n = ts1.shape[0]
+    m = ts2.shape[0]
+    width = 2*w + 3
+
+    prev = np.full(width, np.inf)
+    curr = np.full(width, np.inf)
+    prev[w+1] = 0.0
+
+    for i in range(1, n+1):
+        curr[:] = np.inf
+        row_min = np.inf
+        for j in range(max(1, i-w), min(m, i+w) + 1):
+            k = j - i + w + 1
+            d = (ts1[i-1] - ts2[j-1]) ** 2
+            best = prev[k]
+            if prev[k+1] < best:
+                best = prev[k+1]
+            if curr[k-1] < best:
+                best = curr[k-1]
+            curr[k] = d + best
+            if curr[k] < row_min:
+                row_min = curr[k]
+
+        # every path has to cross the row, so the whole DTW exceeds its minimum
+        if row_min > abandon_above:
+            return np.inf
+
+        prev, curr = curr, prev
+
+    return prev[m - n + w + 1]
+
+
+def DTW_distance(ts1, ts2, r=None, abandon_above=None):
     """
     Calculate DTW distance.
 
@@ -75,8 +251,12 @@ def DTW_distance(ts1, ts2, r=None):
     ts2 : numpy.ndarray
         The second time series.
 
-    r : float
-        Warping window size.
+    r : float, default = None
+        Warping window size. If None, the warping is not constrained.
+
+    abandon_above : float, default = None
+        Early abandoning threshold (e.g. best-so-far). If every cell of some row
+        of the cost matrix exceeds it, the computation stops and np.inf is returned.
     
     Returns
     -------
@@ -84,20 +264,206 @@ def DTW_distance(ts1, ts2, r=None):
         DTW distance between ts1 and ts2.
     """
 
-    dtw_dist = 0
+    ts1 = np.asarray(ts1, dtype=np.float64)
+    ts2 = np.asarray(ts2, dtype=np.float64)
 
-    # INSERT YOUR CODE
+    w = _DTW_window(ts1.shape[0], ts2.shape[0], r)
+    if abandon_above is None:
+        abandon_above = np.inf
+
+    dtw_dist = _DTW_band(ts1, ts2, w, float(abandon_above))
 
-    m = len(ts1)
-    r = r*m
-    D = np.zeros((m+1,m+1))
-    D[0,:] = np.inf
-    D[:,0] = np.inf
-    D[0,0] = 0
-    for i in range(0,m) :
-      for j in range(max(0,int(i-r)),min(m,int(i+r))):
-        d = (ts1[i] - ts2[j]) ** 2
-        D[i+1,j+1] = d + min(D[i,j+1],D[i+1,j],D[i,j])
-    dtw_dist = D[m ,m ]
-    #print(D)
     return dtw_dist
+
+
+@njit(cache=True)
+def _DTW_band_path(ts1, ts2, w):
+    """
+    Compute DTW distance inside the Sakoe-Chiba band and backtrack the warping path.
+
+    The band of the cost matrix is stored row by row like in _DTW_band
+    (cell D[i, j] at position j - i + w + 1 of the row i), so the memory is O(n*w).
+    """
+
+    n = ts1.shape[0]
+    m = ts2.shape[0]
+    width = 2*w + 3
+
+    D = np.full((n+1, width), np.inf)
+    D[0, w+1] = 0.0
+
+    for i in range(1, n+1):
+        for j in range(max(1, i-w), min(m, i+w) + 1):
+            k = j - i + w + 1
+            best = D[i-1, k]
+            if D[i-1, k+1] < best:
+                best = D[i-1, k+1]
+            if D[i, k-1] < best:
+                best = D[i, k-1]
+            D[i, k] = (ts1[i-1] - ts2[j-1]) ** 2 + best
+
+    path = np.empty((n + m, 2), dtype=np.int64)
+    length = 0
+    i = n
+    j = m
+    while True:
+        path[length, 0] = i - 1
+        path[length, 1] = j - 1
+        length += 1
+        if i == 1 and j == 1:
+            break
+
+        # the predecessors (i-1, j-1), (i-1, j) and (i, j-1) in the band coordinates
+        k = j - i + w + 1
+        diag = D[i-1, k]
+        up = D[i-1, k+1]
+        left = D[i, k-1]
+        if diag <= up and diag <= left:
+            i -= 1
+            j -= 1
+        elif up <= left:
+            i -= 1
+        else:
+            j -= 1
+
+    return D[n, m - n + w + 1], path[:length][::-1].copy()
+
+
+def DTW_path(ts1, ts2, r=None):
+    """
+    Calculate DTW distance and the optimal warping path.
+
+    Parameters
+    ----------
+    ts1 : numpy.ndarray
+        The first time series.
+
+    ts2 : numpy.ndarray
+        The second time series.
+
+    r : float, default = None
+        Warping window size. If None, the warping is not constrained.
+
+    Returns
+    -------
+    dtw_dist : float
+        DTW distance between ts1 and ts2.
+
+    path : numpy.ndarray (2d array of shape (path_length, 2))
+        Pairs of the aligned indices (of ts1 and ts2) from the start to the end of time series.
+    """
+
+    ts1 = np.asarray(ts1, dtype=np.float64)
+    ts2 = np.asarray(ts2, dtype=np.float64)
+
+    w = _DTW_window(ts1.shape[0], ts2.shape[0], r)
+    dtw_dist, path = _DTW_band_path(ts1, ts2, w)
+
+    return dtw_dist, path
+
+
+def Kim_features(ts):
+    """
+    Extract the values of time series used by LB_Kim lower bound.
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series (or time series set).
+
+    Returns
+    -------
+    features : numpy.ndarray
+        The first, last, minimum and maximum values of time series (along the last axis).
+    """
+
+    return np.stack([ts[..., 0], ts[..., -1], np.min(ts, axis=-1), np.max(ts, axis=-1)], axis=-1)
+
+
+def LB_Kim_by_features(features1, features2):
+    """
+    Compute LB_Kim lower bound of DTW distance from the precomputed features
+    of time series (see Kim_features). The time series must be longer than one point.
+
+    Parameters
+    ----------
+    features1 : numpy.ndarray
+        Features of the first time series (or time series set).
+
+    features2 : numpy.ndarray
+        Features of the second time series (or time series set).
+
+    Returns
+    -------
+    lb_Kim : float or numpy.ndarray
+        LB_Kim lower bound.
+    """
+
+    sq_diff = (features1 - features2) ** 2
+
+    # the first and last cells are always on the warping path
+    lb_Kim = sq_diff[..., 0] + sq_diff[..., 1]
+    lb_Kim = np.maximum(lb_Kim, sq_diff[..., 2])
+    lb_Kim = np.maximum(lb_Kim, sq_diff[..., 3])
+
+    return lb_Kim
+
+
+def LB_Kim(ts1, ts2):
+    """
+    Compute LB_Kim lower bound of DTW distance.
+
+    The bound uses the first, last, minimum and maximum values of time series.
+    Like DTW_distance, it is a sum of squared differences (without the root).
+    Time series sets (2d arrays) are processed row by row with broadcasting.
+
+    Parameters
+    ----------
+    ts1 : numpy.ndarray
+        The first time series (or time series set).
+
+    ts2 : numpy.ndarray
+        The second time series (or time series set).
+
+    Returns
+    -------
+    lb_Kim : float or numpy.ndarray
+        LB_Kim lower bound.
+    """
+
+    if np.shape(ts1)[-1] == 1:
+        return (ts1[..., 0] - ts2[..., 0]) ** 2
+
+    lb_Kim = LB_Kim_by_features(Kim_features(ts1), Kim_features(ts2))
+
+    return lb_Kim
+
+
+def LB_Keogh(ts, upper, lower):
+    """
+    Compute LB_Keogh lower bound of DTW distance.
+
+    Like DTW_distance, it is a sum of squared differences (without the root).
+    Time series sets (2d arrays) are processed row by row with broadcasting.
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series (or time series set).
+
+    upper : numpy.ndarray
+        Upper warping envelope of the other time series.
+
+    lower : numpy.ndarray
+        Lower warping envelope of the other time series.
+
+    Returns
+    -------
+    lb_Keogh : float or numpy.ndarray
+        LB_Keogh lower bound.
+    """
+
+    excess = np.maximum(ts - upper, 0) + np.maximum(lower - ts, 0)
+    lb_Keogh = np.sum(excess ** 2, axis=-1)
+
+    return lb_Keogh
@@ -0,0 +1,130 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def create_shared_array(shape, dtype=np.float64, data=None):
+    """
+    Allocate an array in shared memory.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array.
+
+    dtype : numpy.dtype, default = numpy.float64
+        Type of the array elements.
+
+    data : numpy.ndarray, default = None
+        Values to copy into the array.
+
+    Returns
+    -------
+    shm : multiprocessing.shared_memory.SharedMemory
+        The shared memory block (the caller has to release it with release_shared_arrays).
+
+    a : numpy.ndarray
+        The array backed by the shared memory block.
+    """
+
+    nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    a = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    if data is not None:
+        a[...] = data
+
+    return shm, a
+
+
+def share_arrays(arrays):
+    """
+    Copy the arrays into shared memory.
+
+    Parameters
+    ----------
+    arrays : dict
+        Array name -> numpy.ndarray.
+
+    Returns
+    -------
+    blocks : list
+        The shared memory blocks (to be released with release_shared_arrays).
+
+    specs : dict
+        Array name -> (shared memory name, shape, dtype), to be passed to attach_shared_arrays.
+    """
+
+    blocks = []
+    specs = {}
+    for key, a in arrays.items():
+        a = np.asarray(a)
+        shm, _ = create_shared_array(a.shape, a.dtype, a)
+        blocks.append(shm)
+        specs[key] = (shm.name, a.shape, a.dtype.str)
+
+    return blocks, specs
+
+
+def attach_shared_arrays(specs):
+    """
+    Attach the arrays placed in shared memory by another process.
+
+    Parameters
+    ----------
+    specs : dict
+        Array name -> (shared memory name, shape, dtype).
+
+    Returns
+    -------
+    arrays : dict
+        Array name -> numpy.ndarray backed by the shared memory.
+
+    blocks : list
+        The attached shared memory blocks (they must be kept alive while the arrays are used).
+    """
+
+    arrays = {}
+    blocks = []
+    for key, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    return arrays, blocks
+
+
+def release_shared_arrays(blocks):
+    """
+    Close and remove the shared memory blocks created by share_arrays.
+
+    Parameters
+    ----------
+    blocks : list
+        The shared memory blocks.
+    """
+
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def split_range(n, chunks_num):
+    """
+    Split the range [0, n) into contiguous chunks of almost equal sizes.
+
+    Parameters
+    ----------
+    n : int
+        Length of the range.
+
+    chunks_num : int
+        Number of the chunks.
+
+    Returns
+    -------
+    bounds : list of tuples (int, int)
+        Start and stop of each non-empty chunk.
+    """
+
+    edges = np.linspace(0, n, min(chunks_num, n) + 1).astype(np.int64)
+
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
@@ -1,6 +1,6 @@
 import numpy as np
-import math
-import random
+import bisect
+from numba import njit
 
 
 def z_normalize(ts):
@@ -24,7 +24,50 @@ def z_normalize(ts):
     return norm_ts
 
 
-def sliding_window(ts, window, step=1):
+def batch_z_normalize(subs_matrix, out=None, dtype=np.float64, mean=None, std=None):
+    """
+    Z-normalize every row of the subsequence matrix in one vectorized pass.
+
+    Parameters
+    ----------
+    subs_matrix : numpy.ndarray (2d array of shape (subs_number, subs_length))
+        Matrix of subsequences.
+
+    out : numpy.ndarray, default = None
+        Array to write the result into. Passing subs_matrix itself normalizes it in-place.
+
+    dtype : numpy.dtype, default = numpy.float64
+        Type of the result if out is None (e.g. numpy.float32).
+
+    mean : numpy.ndarray, default = None
+        Precomputed means of the rows (e.g. from sliding_stats).
+
+    std : numpy.ndarray, default = None
+        Precomputed standard deviations of the rows (e.g. from sliding_stats).
+
+    Returns
+    -------
+    norm_matrix : numpy.ndarray
+        Matrix of the z-normalized subsequences. The constant subsequences
+        are turned into zero rows.
+    """
+
+    if mean is None:
+        mean = np.mean(subs_matrix, axis=1)
+    if std is None:
+        std = np.std(subs_matrix, axis=1)
+    if out is None:
+        out = np.empty(np.shape(subs_matrix), dtype=dtype)
+
+    std = np.where(std > 0, std, 1)
+
+    np.subtract(subs_matrix, np.asarray(mean)[:, np.newaxis], out=out)
+    out /= np.asarray(std, dtype=out.dtype)[:, np.newaxis]
+
+    return out
+
+
+def sliding_window(ts, window, step=1, copy=False):
     """
     Extract subsequences from time series using sliding window.
 
@@ -39,56 +82,509 @@ def sliding_window(ts, window, step=1):
     step : int
         Step of the sliding window.
 
+    copy : bool, default = False
+        If False, return a read-only strided view on the time series
+        (no data is copied). If True, return a new matrix of subsequences.
+
     Returns
     -------
     subs_matrix : numpy.ndarray
         Matrix of subsequences.
     """
-    
-    n = ts.shape[0]
-    N = math.ceil((n-window+1)/step)
 
-    subs_matrix = np.zeros((N, window))
+    ts = np.asarray(ts)
 
-    for i in range(N):
-        start_idx = i*step
-        end_idx = start_idx + window
-        subs_matrix[i] = ts[start_idx:end_idx]
+    subs_matrix = np.lib.stride_tricks.sliding_window_view(ts, window)[::step]
+
+    if copy:
+        subs_matrix = np.array(subs_matrix, dtype=np.float64)
 
     return subs_matrix
 
 
-def random_walk(n):
+def _allocate(n, out, dtype):
     """
-    Generate the time series based on Random Walk model.
+    Allocate the array for the generated time series.
 
     Parameters
     ----------
     n : int
         The length of time series.
-    
+
+    out : numpy.ndarray or str
+        Array to write the time series into, or path of .npy file
+        which is created and opened as a memory map. If None, a new array is allocated.
+
+    dtype : numpy.dtype
+        Type of the time series values.
+
+    Returns
+    -------
+    ts : numpy.ndarray
+        Array (or memory map) of length n.
+    """
+
+    if out is None:
+        return np.empty(n, dtype=dtype)
+
+    if isinstance(out, str):
+        return np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(n,))
+
+    if out.shape != (n,):
+        raise ValueError(f"out must have shape {(n,)}, got {out.shape}")
+
+    return out
+
+
+def random_walk(n, seed=None, out=None, dtype=np.float64, chunk_size=1_000_000):
+    """
+    Generate the time series based on Random Walk model
+    (the series starts at 0 and moves up or down by 1 at each step).
+
+    Parameters
+    ----------
+    n : int
+        The length of time series.
+
+    seed : int or numpy.random.Generator, default = None
+        Seed of the random generator.
+
+    out : numpy.ndarray or str, default = None
+        Array or path of .npy file to write the time series into.
+
+    dtype : numpy.dtype, default = numpy.float64
+        Type of the time series values.
+
+    chunk_size : int, default = 1000000
+        Number of points generated at once.
+
     Returns
     -------
     random_walk_ts : numpy.ndarray
         The generated time series.
-
     """
 
+    rng = np.random.default_rng(seed)
+    random_walk_ts = _allocate(n, out, dtype)
+
     value = 0
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        steps = rng.choice(np.array([-1, 1]), size=stop-start)
+        if start == 0:
+            steps[0] = 0
+        chunk = np.cumsum(steps) + value
+        random_walk_ts[start:stop] = chunk
+        value = chunk[-1]
+
+    return random_walk_ts
+
+
+@njit(cache=True)
+def _envelope(ts, w, upper, lower):
+    """
+    Compute the warping envelopes of the rows of time series set with Lemire's
+    streaming min/max algorithm: the candidate maximums (minimums) of the window are
+    kept in a monotone deque, so every point is pushed and popped once, O(n) per row.
+    """
+
+    n = ts.shape[1]
+    max_deque = np.empty(n, dtype=np.int64)
+    min_deque = np.empty(n, dtype=np.int64)
+
+    for row in range(ts.shape[0]):
+        x = ts[row]
+        max_head = max_tail = 0
+        min_head = min_tail = 0
+
+        for j in range(n + w):
+            if j < n and not np.isnan(x[j]):
+                # the points dominated by x[j] can not be the window maximum (minimum) anymore
+                while max_tail > max_head and x[max_deque[max_tail-1]] <= x[j]:
+                    max_tail -= 1
+                max_deque[max_tail] = j
+                max_tail += 1
+                while min_tail > min_head and x[min_deque[min_tail-1]] >= x[j]:
+                    min_tail -= 1
+                min_deque[min_tail] = j
+                min_tail += 1
+
+            # the window [i-w, i+w] of the point i is complete
+            i = j - w
+            if i < 0:
+                continue
+            while max_tail > max_head and max_deque[max_head] < i - w:
+                max_head += 1
+            while min_tail > min_head and min_deque[min_head] < i - w:
+                min_head += 1
+            upper[row, i] = x[max_deque[max_head]] if max_tail > max_head else np.nan
+            lower[row, i] = x[min_deque[min_head]] if min_tail > min_head else np.nan
+
+
+def envelope(ts, w):
+    """
+    Compute the upper and lower warping envelopes of time series.
+
+    The envelopes are the maximum and minimum of the points within w positions
+    from each point. Time series sets (2d arrays, e.g. a sliding window view of
+    candidate subsequences) are processed row by row. The envelopes are computed
+    in O(n) regardless of w. NaN values are skipped.
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series (or time series set).
+
+    w : int
+        Half-width of the warping window (in points).
+
+    Returns
+    -------
+    upper : numpy.ndarray
+        The upper envelope.
+
+    lower : numpy.ndarray
+        The lower envelope.
+    """
+
+    ts = np.asarray(ts, dtype=np.float64)
+    rows = ts.reshape(-1, ts.shape[-1])
+
+    upper = np.empty(rows.shape)
+    lower = np.empty(rows.shape)
+    _envelope(rows, int(w), upper, lower)
+
+    return upper.reshape(ts.shape), lower.reshape(ts.shape)
+
+
+def _fft_length(n):
+    """
+    The smallest length not less than n which has no prime factors other than 2, 3 and 5
+    (FFT of such lengths is fast).
+    """
+
+    best = 1 << max(int(n - 1).bit_length(), 0)
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            length = p35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            p35 *= 3
+        p5 *= 5
+
+    return best
+
+
+def series_fft(ts):
+    """
+    Compute the FFT of time series for the sliding dot products.
+
+    The non-finite values are replaced with zeros (the subsequences containing
+    them are excluded by sliding_stats anyway).
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series.
+
+    Returns
+    -------
+    ts_fft : numpy.ndarray
+        The real FFT of zero-padded time series.
+    """
+
+    ts = np.asarray(ts, dtype=np.float64)
+    ts = np.where(np.isfinite(ts), ts, 0)
+
+    return np.fft.rfft(ts, _fft_length(ts.shape[0]))
+
+
+def sliding_dot_product(query, ts_fft, n):
+    """
+    Calculate the dot products of the query and all subsequences of time series
+    with FFT in O(n log n).
+
+    Parameters
+    ----------
+    query : numpy.ndarray
+        Query.
+
+    ts_fft : numpy.ndarray
+        FFT of time series computed by series_fft.
+
+    n : int
+        Length of time series.
+
+    Returns
+    -------
+    QT : numpy.ndarray
+        Dot products of the query and subsequences.
+    """
+
+    m = len(query)
+    fft_len = _fft_length(n)
+
+    query_fft = np.fft.rfft(np.asarray(query, dtype=np.float64)[::-1], fft_len)
+    QT = np.fft.irfft(ts_fft * query_fft, fft_len)
+
+    return QT[m-1:n]
+
+
+@njit(cache=True)
+def _sliding_stats(ts, m, mu, sigma):
+    """
+    Fill the sliding means and standard deviations of the time series.
+
+    The statistics are updated with the sliding form of Welford's recurrence.
+    The recurrence is restarted every m windows, so the rounding error does not
+    accumulate along long time series. Windows containing non-finite values get
+    mean np.inf and standard deviation np.nan.
+    """
+
+    N = ts.shape[0] - m + 1
+    finite = np.isfinite(ts)
+    x = np.where(finite, ts, 0.0)
+
+    mean = 0.0
+    M2 = 0.0
+    nonfinite_num = 0
+
+    for k in range(N):
+        if k % m == 0:
+            mean = 0.0
+            M2 = 0.0
+            nonfinite_num = 0
+            for t in range(m):
+                delta = x[k+t] - mean
+                mean += delta / (t+1)
+                M2 += delta * (x[k+t] - mean)
+                if not finite[k+t]:
+                    nonfinite_num += 1
+        else:
+            x_out = x[k-1]
+            x_in = x[k+m-1]
+            prev_mean = mean
+            mean = prev_mean + (x_in - x_out) / m
+            M2 += (x_in - x_out) * (x_in - mean + x_out - prev_mean)
+            if not finite[k-1]:
+                nonfinite_num -= 1
+            if not finite[k+m-1]:
+                nonfinite_num += 1
+
+        if nonfinite_num > 0:
+            mu[k] = np.inf
+            sigma[k] = np.nan
+        else:
+            mu[k] = mean
+            sigma[k] = np.sqrt(max(M2, 0.0) / m)
+
+
+def sliding_stats(ts, m):
+    """
+    Calculate the means and standard deviations of all subsequences of time series
+    in one pass.
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series.
+
+    m : int
+        Subsequence length.
+
+    Returns
+    -------
+    mu : numpy.ndarray
+        Means of subsequences.
+
+    sigma : numpy.ndarray
+        Standard deviations of subsequences.
+    """
+
+    ts = np.asarray(ts, dtype=np.float64)
+    N = ts.shape[0] - m + 1
+
+    mu = np.empty(N, dtype=np.float64)
+    sigma = np.empty(N, dtype=np.float64)
+    _sliding_stats(ts, m, mu, sigma)
+
+    return mu, sigma
+
+
+def top_k_with_exclusion(a, top_k, excl_zone, largest=False, bound=None, positions=None):
+    """
+    Select the top-k values of the array which are pairwise farther than
+    the exclusion zone from each other.
+
+    The result is the same as of taking the minimum (maximum) repeatedly and
+    applying the exclusion zone around it, but the array is scanned only a few
+    times: a pool of the smallest (largest) values is selected by np.partition
+    and sorted, and the pool is doubled only if the conflicts with the exclusion
+    zones exhaust it.
+
+    Parameters
+    ----------
+    a : numpy.ndarray
+        Array of values (e.g. distance profile or matrix profile).
+        NaN values and the infinity on the worst side (+inf for the smallest
+        values, -inf for the largest ones) are never selected.
+
+    top_k : int
+        Number of the selected values.
+
+    excl_zone : int
+        Size of the exclusion zone.
+
+    largest : bool, default = False
+        Select the largest values instead of the smallest ones.
+
+    bound : float, default = None
+        Values greater (less if largest) than bound are not selected.
+
+    positions : numpy.ndarray, default = None
+        Positions of the values which the exclusion zone is applied to.
+        If None, the indices of the array are used.
+
+    Returns
+    -------
+    top_k_idx : numpy.ndarray
+        Indices of the selected values in the array, from the best to the worst.
+
+    top_k_values : numpy.ndarray
+        The selected values.
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    keys = -a if largest else a
+    if positions is None:
+        positions = np.arange(a.shape[0])
+
+    valid = keys < np.inf
+    if bound is not None:
+        valid &= keys <= (-bound if largest else bound)
+    valid_num = np.count_nonzero(valid)
+    if valid_num < a.shape[0]:
+        keys = np.where(valid, keys, np.inf)
+
+    top_k_idx = []
+    taken = []
+    pool_size = min(valid_num, max(top_k, 1)*(2*excl_zone + 1))
+    processed = 0
+
+    while (len(top_k_idx) < top_k) and (processed < valid_num):
+        # the pool holds all values up to the pool_size-th smallest one (ties included),
+        # so its sorted order is a prefix of the sorted order of the whole array
+        threshold = np.partition(keys, pool_size - 1)[pool_size - 1]
+        pool = np.flatnonzero(keys <= threshold)
+        pool = pool[np.lexsort((positions[pool], keys[pool]))]
+
+        for p in pool[processed:]:
+            pos = positions[p]
+            i = bisect.bisect_left(taken, pos)
+            if ((i < len(taken)) and (taken[i] - pos <= excl_zone)) or ((i > 0) and (pos - taken[i-1] <= excl_zone)):
+                continue
+            taken.insert(i, pos)
+            top_k_idx.append(p)
+            if len(top_k_idx) == top_k:
+                break
+
+        processed = len(pool)
+        pool_size = min(valid_num, 2*pool_size)
+
+    top_k_idx = np.array(top_k_idx, dtype=np.int64)
+
+    return top_k_idx, a[top_k_idx]
+
+
+class SlidingStats:
+    """
+    Mean and standard deviation of the last m points of a streaming time series.
+
+    Parameters
+    ----------
+    m : int
+        Subsequence length.
+    """
+
+    def __init__(self, m):
+
+        self.m = m
+        self._window = np.zeros(m, dtype=np.float64)
+        self._count = 0
+        self._mean = 0.0
+        self._M2 = 0.0
+
+
+    def _restart(self):
+        """
+        Recompute the statistics of the current window from scratch.
+        """
+
+        self._mean = np.mean(self._window)
+        self._M2 = np.sum((self._window - self._mean) ** 2)
+
+
+    def update(self, value):
+        """
+        Append a point to the stream.
+
+        Parameters
+        ----------
+        value : float
+            The new point of time series.
+
+        Returns
+        -------
+        mu : float
+            Mean of the last m points (np.nan until m points are received).
+
+        sigma : float
+            Standard deviation of the last m points (np.nan until m points are received).
+        """
+
+        pos = self._count % self.m
+        x_out = self._window[pos]
+        self._window[pos] = value
+        self._count += 1
+
+        if self._count <= self.m:
+            delta = value - self._mean
+            self._mean += delta / self._count
+            self._M2 += delta * (value - self._mean)
+            if self._count < self.m:
+                return np.nan, np.nan
+        elif pos == self.m - 1:
+            # restart the recurrence once per window to cancel rounding drift
+            self._restart()
+        else:
+            prev_mean = self._mean
+            self._mean = prev_mean + (value - x_out) / self.m
+            self._M2 += (value - x_out) * (value - self._mean + x_out - prev_mean)
+
+        return self._mean, np.sqrt(max(self._M2, 0.0) / self.m)
+
+
+    def extend(self, values):
+        """
+        Append points to the stream.
 
-    random_walk_ts = [value]
-    directions = ["UP", "DOWN"]
+        Parameters
+        ----------
+        values : numpy.ndarray
+            The new points of time series.
 
-    for i in range(1, n):
-        # Randomly select either UP or DOWN
-        step = random.choice(directions)
+        Returns
+        -------
+        mu : numpy.ndarray
+            Means of the windows ending at each new point.
 
-        # Move the object up or down
-        if step == "UP":
-            value += 1
-        elif step == "DOWN":
-            value -= 1
+        sigma : numpy.ndarray
+            Standard deviations of the windows ending at each new point.
+        """
 
-        random_walk_ts.append(value)
+        stats = np.array([self.update(value) for value in values], dtype=np.float64).reshape(-1, 2)
 
-    return np.array(random_walk_ts)
+        return stats[:, 0], stats[:, 1]
@@ -0,0 +1,291 @@
+import numpy as np
+import time
+
+from modules.utils import batch_z_normalize
+
+
+def _npz_path(file_name):
+    """
+    Append the '.npz' extension to the file name like numpy.savez does.
+    """
+
+    file_name = str(file_name)
+
+    return file_name if file_name.endswith('.npz') else file_name + '.npz'
+
+
+class VPTree:
+    """
+    Vantage-point tree over a time series set for the Euclidean k-NN and range queries.
+
+    Every inner node stores a vantage point and the median distance mu from it to
+    the time series of the node: the closer ones go to the inside subtree, the others
+    to the outside subtree. Queries skip the subtrees which can not contain answers
+    due to the triangle inequality.
+
+    Parameters
+    ----------
+    X : numpy.ndarray (2d array of shape (ts_number, ts_length))
+        Time series set.
+
+    normalize : bool, default = True
+        Z-normalize or not time series (and queries).
+
+    leaf_size : int, default = 16
+        Maximum number of time series in a leaf.
+
+    seed : int or numpy.random.Generator, default = None
+        Seed of the random choice of vantage points.
+    """
+
+    def __init__(self, X, normalize=True, leaf_size=16, seed=None):
+
+        self.normalize = normalize
+        self.leaf_size = leaf_size
+
+        X = np.asarray(X, dtype=np.float64)
+        self.data = batch_z_normalize(X) if normalize else X
+
+        self.build_time = 0.0
+        self.build_dist_num = 0
+        self.visited_num = 0
+
+        if self.data.shape[0] > 0:
+            self._build(np.random.default_rng(seed))
+
+
+    def _build(self, rng):
+        """
+        Build the tree.
+
+        The nodes are stored in arrays: vantage point index (-1 for leaves), median
+        distance, children and the range of the leaf time series in the permutation.
+        """
+
+        start_time = time.perf_counter()
+
+        N = self.data.shape[0]
+        self.perm = np.arange(N)
+        vp, mu, inside, outside, start, stop = [], [], [], [], [], []
+
+        def new_node(node_start, node_stop):
+            for a, value in zip((vp, mu, inside, outside, start, stop), (-1, 0.0, -1, -1, node_start, node_stop)):
+                a.append(value)
+            return len(vp) - 1
+
+        stack = [new_node(0, N)]
+        while stack:
+            node = stack.pop()
+            node_start, node_stop = start[node], stop[node]
+            if node_stop - node_start <= self.leaf_size:
+                continue
+
+            # move a random vantage point to the start of the range
+            pick = rng.integers(node_start, node_stop)
+            self.perm[[node_start, pick]] = self.perm[[pick, node_start]]
+            vp[node] = self.perm[node_start]
+
+            points = self.perm[node_start+1:node_stop]
+            dist = np.linalg.norm(self.data[points] - self.data[vp[node]], axis=1)
+            self.build_dist_num += len(points)
+
+            order = np.argsort(dist, kind='stable')
+            self.perm[node_start+1:node_stop] = points[order]
+            middle = (len(points) + 1) // 2
+            mu[node] = dist[order[middle-1]]
+
+            inside[node] = new_node(node_start+1, node_start+1+middle)
+            outside[node] = new_node(node_start+1+middle, node_stop)
+            stack.extend((inside[node], outside[node]))
+
+        self.vp = np.array(vp, dtype=np.int64)
+        self.mu = np.array(mu, dtype=np.float64)
+        self.inside = np.array(inside, dtype=np.int64)
+        self.outside = np.array(outside, dtype=np.int64)
+        self.start = np.array(start, dtype=np.int64)
+        self.stop = np.array(stop, dtype=np.int64)
+
+        self.build_time = time.perf_counter() - start_time
+
+
+    def _prepare_query(self, x):
+        """
+        Z-normalize the query if the tree is normalized.
+        """
+
+        x = np.asarray(x, dtype=np.float64)
+        if self.normalize:
+            x = batch_z_normalize(x[np.newaxis])[0]
+
+        return x
+
+
+    def _search(self, x, radius_func, on_found):
+        """
+        Traverse the tree, skipping the subtrees farther than the current radius.
+
+        Parameters
+        ----------
+        x : numpy.ndarray
+            The (prepared) query.
+
+        radius_func : callable
+            Returns the current search radius.
+
+        on_found : callable
+            Called with the indices and distances of the visited time series.
+        """
+
+        self.visited_num = 0
+        if self.data.shape[0] == 0:
+            return
+
+        # nodes with the lower bounds of the distance from the query to their time series
+        stack = [(0, 0.0)]
+        while stack:
+            node, lower_bound = stack.pop()
+            if lower_bound > radius_func():
+                continue
+
+            if self.vp[node] < 0:
+                points = self.perm[self.start[node]:self.stop[node]]
+                dist = np.linalg.norm(self.data[points] - x, axis=1)
+                self.visited_num += len(points)
+                on_found(points, dist)
+                continue
+
+            d = np.linalg.norm(self.data[self.vp[node]] - x)
+            self.visited_num += 1
+            on_found(self.vp[node:node+1], np.array([d]))
+
+            # triangle inequality: inside time series are at least d - mu away, outside ones mu - d
+            inside = (self.inside[node], max(d - self.mu[node], 0.0))
+            outside = (self.outside[node], max(self.mu[node] - d, 0.0))
+
+            # the nearer subtree is pushed last to be searched first
+            if d < self.mu[node]:
+                stack.extend((outside, inside))
+            else:
+                stack.extend((inside, outside))
+
+
+    def query(self, x, k=1):
+        """
+        Find the k nearest neighbors of the query.
+
+        Parameters
+        ----------
+        x : numpy.ndarray
+            The query.
+
+        k : int, default = 1
+            Number of neighbors.
+
+        Returns
+        -------
+        dist : numpy.ndarray
+            Distances to the neighbors in ascending order.
+
+        idx : numpy.ndarray
+            Indices of the neighbors in the time series set.
+        """
+
+        x = self._prepare_query(x)
+        k = min(k, self.data.shape[0])
+
+        best_dist = np.full(k, np.inf)
+        best_idx = np.full(k, -1, dtype=np.int64)
+
+        def on_found(points, dist):
+            # merge the visited time series into the current k best
+            all_dist = np.concatenate((best_dist, dist))
+            all_idx = np.concatenate((best_idx, points))
+            keep = np.argsort(all_dist, kind='stable')[:k]
+            best_dist[:] = all_dist[keep]
+            best_idx[:] = all_idx[keep]
+
+        self._search(x, lambda: best_dist[-1], on_found)
+
+        return best_dist, best_idx
+
+
+    def query_radius(self, x, radius):
+        """
+        Find all time series within the distance radius from the query.
+
+        Parameters
+        ----------
+        x : numpy.ndarray
+            The query.
+
+        radius : float
+            The search radius.
+
+        Returns
+        -------
+        dist : numpy.ndarray
+            Distances to the found time series in ascending order.
+
+        idx : numpy.ndarray
+            Indices of the found time series in the time series set.
+        """
+
+        x = self._prepare_query(x)
+
+        found_dist, found_idx = [], []
+
+        def on_found(points, dist):
+            mask = dist <= radius
+            found_dist.append(dist[mask])
+            found_idx.append(points[mask])
+
+        self._search(x, lambda: radius, on_found)
+
+        dist = np.concatenate(found_dist) if found_dist else np.empty(0)
+        idx = np.concatenate(found_idx) if found_idx else np.empty(0, dtype=np.int64)
+        order = np.argsort(dist, kind='stable')
+
+        return dist[order], idx[order]
+
+
+    def save(self, file_name):
+        """
+        Save the tree into .npz file.
+
+        Parameters
+        ----------
+        file_name : str
+            Path of the file ('.npz' is appended if it is missing).
+        """
+
+        np.savez(_npz_path(file_name), data=self.data, normalize=self.normalize, leaf_size=self.leaf_size,
+                 perm=self.perm, vp=self.vp, mu=self.mu, inside=self.inside, outside=self.outside,
+                 start=self.start, stop=self.stop)
+
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Load the tree saved by save.
+
+        Parameters
+        ----------
+        file_name : str
+            Path of the file given to save ('.npz' is appended if it is missing).
+
+        Returns
+        -------
+        tree : VPTree
+            The loaded tree.
+        """
+
+        # the arrays are read from the file (copied into memory) before it is closed
+        with np.load(_npz_path(file_name)) as arrays:
+            data = arrays['data']
+            tree = cls(np.empty((0, data.shape[1])), normalize=False, leaf_size=int(arrays['leaf_size']))
+            tree.normalize = bool(arrays['normalize'])
+            tree.data = data
+            for key in ('perm', 'vp', 'mu', 'inside', 'outside', 'start', 'stop'):
+                setattr(tree, key, arrays[key])
+
+        return tree
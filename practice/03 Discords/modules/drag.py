@@ -1,6 +1,8 @@
 import numpy as np
 from stumpy import core, config
 
+from modules.utils import sliding_stats, top_k_with_exclusion
+
 def _get_chunks_ranges(a, shift=None):
     """
     This function takes an array that contains only integer numbers in ascending order, and return the
@@ -47,10 +49,10 @@ def find_candidates(T, m, M_T, Σ_T, r, init_cands=None, right=True, finite=Fals
         Window size
     
     M_T : ndarray
-        Sliding mean of `T`
+        Sliding mean of `T`. If None, it is computed with `sliding_stats`.
     
     Σ_T : ndarray
-        Sliding standard deviation of `T`
+        Sliding standard deviation of `T`. If None, it is computed with `sliding_stats`.
     
     r : float 
         An estimate of discord_dist. The selected candidates retuned by this function have distances of at least `r` 
@@ -85,6 +87,9 @@ def find_candidates(T, m, M_T, Σ_T, r, init_cands=None, right=True, finite=Fals
     Unlike the MERLIN paper where the exclusion zone is m, the default exclusion zone considered here
     is the STUMPY default config m/4. This can be changed by setting config.STUMPY_EXCL_ZONE_DENOM.
     """    
+    if M_T is None or Σ_T is None:
+        M_T, Σ_T = sliding_stats(T, m)
+
     excl_zone = int(np.ceil(m / config.STUMPY_EXCL_ZONE_DENOM))
     
     k = T.shape[0] - m + 1 
@@ -141,10 +146,10 @@ def refine_candidates(T, m, M_T, Σ_T, is_cands):
         Window size
     
     M_T : numpy.ndarray
-        Sliding mean of `T`
+        Sliding mean of `T`. If None, it is computed with `sliding_stats`.
     
     Σ_T : numpy.ndarray
-        Sliding standard deviation of `T`
+        Sliding standard deviation of `T`. If None, it is computed with `sliding_stats`.
     
     is_cands : numpy.ndarray
         is a 1-dim boolean array, with shape=(k,) where `k` is the total number of subsquences in the time series. 
@@ -157,10 +162,13 @@ def refine_candidates(T, m, M_T, Σ_T, is_cands):
         corresponding distances to their nearest neighbor, provided in the second column. 
         The third column is the indices of the discords' nearest neighbor. 
     """    
+    if M_T is None or Σ_T is None:
+        M_T, Σ_T = sliding_stats(T, m)
+
     excl_zone = int(np.ceil(m / config.STUMPY_EXCL_ZONE_DENOM)) 
     k = T.shape[0] - m + 1
     
-    P = np.full(k, np.NINF, dtype=np.float64) # matrix profile
+    P = np.full(k, -np.inf, dtype=np.float64) # matrix profile
     I = np.full(k, -1, dtype=np.int64) # index of Nearest Neighbor 
     
     for idx in np.flatnonzero(is_cands): 
@@ -175,14 +183,9 @@ def refine_candidates(T, m, M_T, Σ_T, is_cands):
         P[idx] = D[nn_idx]
         I[idx] = nn_idx
     
-    discords_idx = []
-    discords_dist = []
-    discords_nn_idx = [] 
-    while np.any(P>=0):
-        idx = np.argmax(P)
-        discords_idx.append(idx)
-        discords_dist.append(P[idx])
-        discords_nn_idx.append(I[idx])  
-        core.apply_exclusion_zone(P, idx, excl_zone, np.NINF)
+    discords_idx, discords_dist = top_k_with_exclusion(P, k, excl_zone, largest=True, bound=0)
+    discords_nn_idx = list(I[discords_idx])
+    discords_idx = list(discords_idx)
+    discords_dist = list(discords_dist)
      
     return discords_idx, discords_dist, discords_nn_idx
\ No newline at end of file
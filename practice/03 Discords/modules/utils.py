@@ -0,0 +1,169 @@
+import numpy as np
+import bisect
+from numba import njit
+
+
+@njit(cache=True)
+def _sliding_stats(ts, m, mu, sigma):
+    """
+    Fill the sliding means and standard deviations of the time series.
+
+    The statistics are updated with the sliding form of Welford's recurrence.
+    The recurrence is restarted every m windows, so the rounding error does not
+    accumulate along long time series. Windows containing non-finite values get
+    mean np.inf and standard deviation np.nan.
+    """
+
+    N = ts.shape[0] - m + 1
+    finite = np.isfinite(ts)
+    x = np.where(finite, ts, 0.0)
+
+    mean = 0.0
+    M2 = 0.0
+    nonfinite_num = 0
+
+    for k in range(N):
+        if k % m == 0:
+            mean = 0.0
+            M2 = 0.0
+            nonfinite_num = 0
+            for t in range(m):
+                delta = x[k+t] - mean
+                mean += delta / (t+1)
+                M2 += delta * (x[k+t] - mean)
+                if not finite[k+t]:
+                    nonfinite_num += 1
+        else:
+            x_out = x[k-1]
+            x_in = x[k+m-1]
+            prev_mean = mean
+            mean = prev_mean + (x_in - x_out) / m
+            M2 += (x_in - x_out) * (x_in - mean + x_out - prev_mean)
+            if not finite[k-1]:
+                nonfinite_num -= 1
+            if not finite[k+m-1]:
+                nonfinite_num += 1
+
+        if nonfinite_num > 0:
+            mu[k] = np.inf
+            sigma[k] = np.nan
+        else:
+            mu[k] = mean
+            sigma[k] = np.sqrt(max(M2, 0.0) / m)
+
+
+def sliding_stats(ts, m):
+    """
+    Calculate the means and standard deviations of all subsequences of time series
+    in one pass.
+
+    Parameters
+    ----------
+    ts : numpy.ndarray
+        Time series.
+
+    m : int
+        Subsequence length.
+
+    Returns
+    -------
+    mu : numpy.ndarray
+        Means of subsequences.
+
+    sigma : numpy.ndarray
+        Standard deviations of subsequences.
+    """
+
+    ts = np.asarray(ts, dtype=np.float64)
+    N = ts.shape[0] - m + 1
+
+    mu = np.empty(N, dtype=np.float64)
+    sigma = np.empty(N, dtype=np.float64)
+    _sliding_stats(ts, m, mu, sigma)
+
+    return mu, sigma
+
+
+def top_k_with_exclusion(a, top_k, excl_zone, largest=False, bound=None, positions=None):
+    """
+    Select the top-k values of the array which are pairwise farther than
+    the exclusion zone from each other.
+
+    The result is the same as of taking the minimum (maximum) repeatedly and
+    applying the exclusion zone around it, but the array is scanned only a few
+    times: a pool of the smallest (largest) values is selected by np.partition
+    and sorted, and the pool is doubled only if the conflicts with the exclusion
+    zones exhaust it.
+
+    Parameters
+    ----------
+    a : numpy.ndarray
+        Array of values (e.g. distance profile or matrix profile).
+        NaN values and the infinity on the worst side (+inf for the smallest
+        values, -inf for the largest ones) are never selected.
+
+    top_k : int
+        Number of the selected values.
+
+    excl_zone : int
+        Size of the exclusion zone.
+
+    largest : bool, default = False
+        Select the largest values instead of the smallest ones.
+
+    bound : float, default = None
+        Values greater (less if largest) than bound are not selected.
+
+    positions : numpy.ndarray, default = None
+        Positions of the values which the exclusion zone is applied to.
+        If None, the indices of the array are used.
+
+    Returns
+    -------
+    top_k_idx : numpy.ndarray
+        Indices of the selected values in the array, from the best to the worst.
+
+    top_k_values : numpy.ndarray
+        The selected values.
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    keys = -a if largest else a
+    if positions is None:
+        positions = np.arange(a.shape[0])
+
+    valid = keys < np.inf
+    if bound is not None:
+        valid &= keys <= (-bound if largest else bound)
+    valid_num = np.count_nonzero(valid)
+    if valid_num < a.shape[0]:
+        keys = np.where(valid, keys, np.inf)
+
+    top_k_idx = []
+    taken = []
+    pool_size = min(valid_num, max(top_k, 1)*(2*excl_zone + 1))
+    processed = 0
+
+    while (len(top_k_idx) < top_k) and (processed < valid_num):
+        # the pool holds all values up to the pool_size-th smallest one (ties included),
+        # so its sorted order is a prefix of the sorted order of the whole array
+        threshold = np.partition(keys, pool_size - 1)[pool_size - 1]
+        pool = np.flatnonzero(keys <= threshold)
+        pool = pool[np.lexsort((positions[pool], keys[pool]))]
+
+        for p in pool[processed:]:
+            pos = positions[p]
+            i = bisect.bisect_left(taken, pos)
+            if ((i < len(taken)) and (taken[i] - pos <= excl_zone)) or ((i > 0) and (pos - taken[i-1] <= excl_zone)):
+                continue
+            taken.insert(i, pos)
+            top_k_idx.append(p)
+            if len(top_k_idx) == top_k:
+                break
+
+        processed = len(pool)
+        pool_size = min(valid_num, 2*pool_size)
+
+    top_k_idx = np.array(top_k_idx, dtype=np.int64)
+
+    return top_k_idx, a[top_k_idx]
@@ -2,7 +2,6 @@ import numpy as np
 
 from modules.utils import *
 from stumpy import config
-from stumpy import core
 
 
 def top_k_discords(matrix_profile, top_k=3, exclusion_zone=None):
@@ -36,21 +35,19 @@ def top_k_discords(matrix_profile, top_k=3, exclusion_zone=None):
     
 
     discords_idx = np.full(top_k, -1, dtype=np.int64)
-    discords_dist = np.full(top_k, np.NINF, dtype=np.float64)
+    discords_dist = np.full(top_k, -np.inf, dtype=np.float64)
     discords_nn_idx = np.full(top_k, -1, dtype=np.int64)
 
-    for i in range(top_k):
-        if np.all(P == np.NINF):
-            break
-        mp_discord_idx = np.argmax(P)
+    excl_zone = 0 if exclusion_zone is None else exclusion_zone
+    mp_discords_idx, mp_discords_dist = top_k_with_exclusion(P, top_k, excl_zone, largest=True)
 
+    for i, mp_discord_idx in enumerate(mp_discords_idx):
         discords_idx[i] = mp_discord_idx
-        discords_dist[i] = P[mp_discord_idx]
+        discords_dist[i] = mp_discords_dist[i]
         nnl = matrix_profile['indices']['left'][mp_discord_idx]
         nnr = matrix_profile['indices']['right'][mp_discord_idx]
         discords_nn_idx[i] = nnl if P[mp_discord_idx] - nnl < P[mp_discord_idx] - nnr else nnr
 
-        core.apply_exclusion_zone(P, discords_idx[i], exclusion_zone, val=np.NINF)
     return {'indices': discords_idx,
             'distances': discords_dist,
             'nn_indices': discords_nn_idx
@@ -4,7 +4,6 @@ import numpy as np
 from modules.utils import *
 
 from stumpy import config
-from stumpy import core
 
 
 def top_k_motifs(matrix_profile, top_k=3, exclusion_zone=None):
@@ -55,23 +54,18 @@ def top_k_motifs(matrix_profile, top_k=3, exclusion_zone=None):
 
     
 
-    discords_idx = np.full(top_k, -1, dtype=np.int64)
-    discords_dist = np.full(top_k, np.PINF, dtype=np.float64)
-    discords_nn_idx = np.full(top_k, -1, dtype=np.int64)
-
-    for i in range(top_k):
-        if np.all(P == np.PINF):
-            break
-        mp_discord_idx = np.argmin(P)
-        if P[mp_discord_idx] == np.NINF:
-          top_k = top_k+1
-        else:
-          discords_idx[i] = mp_discord_idx
-          discords_dist[i] = P[mp_discord_idx]
-          motifs_idx_left.append(matrix_profile['indices']['left'][mp_discord_idx])
-          motifs_idx_right.append(matrix_profile['indices']['right'][mp_discord_idx])
-        
-        core.apply_exclusion_zone(P, discords_idx[i], exclusion_zone, val=np.PINF)
+    # -inf entries of the matrix profile are not motifs, they are skipped
+    P[P == -np.inf] = np.inf
+
+    excl_zone = 0 if exclusion_zone is None else exclusion_zone
+    mp_motifs_idx, mp_motifs_dist = top_k_with_exclusion(P, top_k, excl_zone)
+
+    motifs_dist = np.full(top_k, np.inf, dtype=np.float64)
+    motifs_dist[:len(mp_motifs_dist)] = mp_motifs_dist
+    for mp_motif_idx in mp_motifs_idx:
+        motifs_idx_left.append(matrix_profile['indices']['left'][mp_motif_idx])
+        motifs_idx_right.append(matrix_profile['indices']['right'][mp_motif_idx])
+
     return {'indices': np.array([motifs_idx_left,motifs_idx_right]).T,
-            'distances': discords_dist
+            'distances': motifs_dist
             }
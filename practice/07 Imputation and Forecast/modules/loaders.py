@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+import os
+import json
+
+
+CACHE_DIR_NAME = '.ts_cache'
+
+
+def _cache_paths(file_name, cache_dir, labels, dtype):
+    """
+    Build the paths of the cache files of the text dataset.
+
+    Every combination of labels and dtype has its own cache files, so building
+    one cache never overwrites the files memory-mapped by the earlier calls.
+
+    Parameters
+    ----------
+    file_name : str
+        Path of the text dataset.
+
+    cache_dir : str
+        Directory of the cache. If None, the '.ts_cache' directory beside the dataset is used.
+
+    labels : bool
+        The first column contains class labels or not.
+
+    dtype : numpy.dtype
+        Type of the cached values.
+
+    Returns
+    -------
+    paths : dict
+        Paths of the metadata, values and labels files.
+    """
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_name)), CACHE_DIR_NAME)
+    prefix = os.path.join(cache_dir, f"{os.path.basename(file_name)}.{np.dtype(dtype).name}")
+    if labels:
+        prefix += '.labeled'
+
+    return {'meta': prefix + '.json',
+            'values': prefix + '.values.bin',
+            'labels': prefix + '.labels.npy'}
+
+
+def _source_signature(file_name):
+    """
+    Size and modification time of the text dataset (to detect stale caches).
+    """
+
+    stat = os.stat(file_name)
+
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_meta(paths, signature, labels, dtype):
+    """
+    Read the cache metadata if the cache is valid for the text dataset.
+
+    Returns
+    -------
+    meta : dict
+        The cache metadata or None if the cache has to be (re)built.
+    """
+
+    if not os.path.exists(paths['meta']):
+        return None
+
+    with open(paths['meta']) as f:
+        meta = json.load(f)
+
+    if (meta.get('source') != signature) or (meta.get('labels') != labels) or (meta.get('dtype') != np.dtype(dtype).str):
+        return None
+
+    return meta
+
+
+def _build_cache(file_name, paths, signature, labels, dtype, chunk_size):
+    """
+    Parse the whitespace-delimited text dataset chunk by chunk and store
+    values and labels into the binary cache.
+
+    The old metadata is removed first and the files are written under temporary
+    names and moved into place, so an interrupted build is never taken as valid
+    and the memory maps of the old cache files stay intact.
+
+    Returns
+    -------
+    meta : dict
+        The cache metadata.
+    """
+
+    os.makedirs(os.path.dirname(paths['meta']), exist_ok=True)
+    if os.path.exists(paths['meta']):
+        os.remove(paths['meta'])
+
+    tmp_paths = {key: path + '.tmp' for key, path in paths.items()}
+
+    rows_num = 0
+    cols_num = None
+    labels_chunks = []
+
+    try:
+        with open(tmp_paths['values'], 'wb') as values_file:
+            for chunk in pd.read_csv(file_name, header=None, sep=r'\s+', chunksize=chunk_size):
+                data = chunk.to_numpy(dtype=np.float64)
+                if labels:
+                    labels_chunks.append(data[:, 0])
+                    data = data[:, 1:]
+                values_file.write(np.ascontiguousarray(data, dtype=dtype).tobytes())
+                rows_num += data.shape[0]
+                cols_num = data.shape[1]
+    except pd.errors.EmptyDataError:
+        rows_num = 0
+
+    if (rows_num == 0) or (cols_num == 0):
+        os.remove(tmp_paths['values'])
+        raise ValueError(f"Dataset {file_name} contains no values")
+
+    os.replace(tmp_paths['values'], paths['values'])
+
+    if labels:
+        with open(tmp_paths['labels'], 'wb') as labels_file:
+            np.save(labels_file, np.concatenate(labels_chunks))
+        os.replace(tmp_paths['labels'], paths['labels'])
+
+    meta = {'source': signature,
+            'labels': labels,
+            'dtype': np.dtype(dtype).str,
+            'shape': [rows_num, cols_num]}
+
+    # the metadata is written last, so an interrupted build is never taken as valid
+    with open(tmp_paths['meta'], 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_paths['meta'], paths['meta'])
+
+    return meta
+
+
+def load_dataset(file_name, labels=False, cache_dir=None, dtype=np.float64, chunk_size=100000):
+    """
+    Load the whitespace-delimited text dataset (e.g. UCR format or one value per line).
+
+    The text is parsed only on the first call and converted into a binary cache.
+    Later calls open the cached values as a read-only memory map, so even datasets
+    larger than RAM can be passed to the algorithms directly.
+
+    Parameters
+    ----------
+    file_name : str
+        Path of the text dataset.
+
+    labels : bool, default = False
+        If True, the first column contains class labels (UCR format)
+        and is stored separately from the values.
+
+    cache_dir : str, default = None
+        Directory of the cache. If None, the '.ts_cache' directory beside the dataset is used.
+
+    dtype : numpy.dtype, default = numpy.float64
+        Type of the cached values.
+
+    chunk_size : int, default = 100000
+        Number of text lines parsed at once while building the cache.
+
+    Returns
+    -------
+    values : numpy.memmap
+        Time series (1d array if the dataset has one column of values)
+        or time series set (2d array of shape (ts_number, ts_length)).
+
+    ts_labels : numpy.ndarray
+        Labels of the time series (only if labels is True).
+    """
+
+    paths = _cache_paths(file_name, cache_dir, labels, dtype)
+    signature = _source_signature(file_name)
+
+    meta = _read_meta(paths, signature, labels, dtype)
+    if meta is None:
+        meta = _build_cache(file_name, paths, signature, labels, dtype, chunk_size)
+
+    rows_num, cols_num = meta['shape']
+    values = np.memmap(paths['values'], dtype=np.dtype(meta['dtype']), mode='r', shape=(rows_num, cols_num))
+    if cols_num == 1:
+        values = values[:, 0]
+
+    if labels:
+        return values, np.load(paths['labels'])
+
+    return values